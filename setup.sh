@@ -6,8 +6,9 @@ if [ -z "$ENV_INSTALLED" ]; then
     conda create --yes -n $ENV python=3.8
 fi
 conda activate $ENV
-conda install --yes numpy pandas matplotlib samtools maxentpy biopython scikit-learn tabulate -c bioconda -c conda-forge
-pip install spliceai[cpu] kipoi pyfaidx cispliceai[cpu]
+conda install --yes numpy pandas matplotlib samtools bcftools htslib maxentpy biopython scikit-learn tabulate -c bioconda -c conda-forge
+# src/cis_annotation.py builds on internals of cispliceai's Annotator, so it is pinned to the version it was verified against
+pip install spliceai[cpu] kipoi pyfaidx cispliceai[cpu]==1.2.2
 
 mkdir -p third-party
 cd third-party
@@ -75,4 +76,14 @@ cd ..
 # pre-process mmsplice gencode
 conda activate $kipoi_env_name
 python src/setup/mmsplice.py
+conda deactivate
+
+# pack the reference genome into 2 bits per nucleotide for fast, shared random access
+conda activate $ENV
+python src/setup/pack_genome.py
+conda deactivate
+
+# precompute reference MES score tracks used by MES (Sliding); this takes a few hours but is only needed once
+conda activate $ENV
+python src/setup/mes_tracks.py
 conda deactivate
\ No newline at end of file
@@ -2,110 +2,113 @@
 Aggregates all predictions with ground truth into predictions/joined.
 Assumes cwd to be project root
 '''
+import argparse
+import contextlib
+import fcntl
+import itertools
+import json
 import pandas as pd
-import pysam
 import os
 import numpy as np
+import re
+import shutil
 import sys
+import tempfile
 
-def aggregate():
-    predictors = set()
-
+def aggregate(incremental=False):
+    '''
+    Joins the predictions of all predictors with the ground truth.
+    If `incremental`, only predictors whose input files changed since the last run are re-ingested, the others are taken over from the store.
+    '''
     sys.path.append(os.path.abspath('.'))
     from src import helpers 
 
     # read in variant locations and ground truth
-    df = pd.read_csv(os.path.join('variants', 'variants.csv')).set_index('ID')
+    variants_path = os.path.join('variants', 'variants.csv')
+    df = pd.read_csv(variants_path).set_index('ID')
 
     # ----- PARSE VCF PREDICTION FILES -----
 
-    # functions to extract binary prediction and corresponding effect position (if possible) from VCF info column
-    # each emits a tuple of (score, (pos_ag, pos_al, pos_dg, pos_dl)); for algorithms where positions are unknown we emit (pos, None)
+    def read_annotations(fname, key):
+        '''
+        Reads the comma-separated values of INFO field `key` of a prediction VCF as columns, without parsing records one by one.
+        `key` may also be a tuple of alternative keys, e.g. written by different versions of a predictor.
+        Returns the variant IDs and a series of annotations, indexed by the number of the record they belong to.
+        '''
+        keys = '|'.join(map(re.escape, (key,) if isinstance(key, str) else key))
+        path = os.path.join('predictions', fname)
+        with open(path) as f:
+            n_meta = sum(1 for _ in itertools.takewhile(lambda line: line.startswith('##'), f))
+
+        vcf = pd.read_csv(path, sep='\t', skiprows=n_meta, usecols=['ID', 'INFO'], dtype=str, na_filter=False)
+        annotations = vcf.INFO.str.extract(f'(?:^|;)(?:{keys})=([^;]*)', expand=False).str.split(',').explode().dropna()
 
-    def parse_cis_format_annotation(info):
+        return pd.Index(vcf.ID), annotations
+
+    # functions to extract binary prediction and corresponding effect position (if possible) from the annotations of all records
+    # each returns a frame indexed by record number with the score and, if known, the positions of AG, AL, DG and DL
+
+    def parse_cis_format_annotations(annotations):
         '''
         Helper function used for SpliceAI, CI-SpliceAI and MES(Sliding).
-        Will look at all annotations and extract the highest delta score, and the respective positions of the highest AG,AL,DG,DL
+        Will look at all annotations of a record and extract the highest delta score, and the respective positions of the highest AG,AL,DG,DL
         '''
-        if len(info) < 1:
-            return None, None
-
-        annotations = np.zeros((len(info), 4, 2), dtype=np.float32) # shape: no. annotations x AG/DG/AL/DL x score/position
-        for i, annotation in enumerate(info):
-            annotation = annotation.split('|')
-            annotations[i,:,0] = annotation[2:2+4]
-            annotations[i,:,1] = annotation[6:6+4]
-
-        DP_AG = annotations[:,0,1][np.argmax(annotations[:,0,0])].astype(int)
-        DP_AL = annotations[:,1,1][np.argmax(annotations[:,1,0])].astype(int)
-        DP_DG = annotations[:,2,1][np.argmax(annotations[:,2,0])].astype(int)
-        DP_DL = annotations[:,3,1][np.argmax(annotations[:,3,0])].astype(int)
-
-        return np.max(annotations[:,:,0]), (DP_AG,DP_AL,DP_DG,DP_DL)
-
-    def parse_cis_info(info):
-        return parse_cis_format_annotation(info['CI-SpliceAI'])
-
-    def parse_spliceai_info(info):
-        if 'SpliceAI' not in info:
-            return None, None
-        
-        annotations = info['SpliceAI']
-        # filter out annotations with '.' as score
-        annotations = [annotation for annotation in annotations if '.' not in annotation.split('|')[2:6]]
-        return parse_cis_format_annotation(annotations)
+        fields = annotations.str.split('|', expand=True)
+        scores = pd.DataFrame(fields.iloc[:, 2:2+4].to_numpy().astype(np.float32), columns=['AG', 'AL', 'DG', 'DL'])
+        positions = fields.iloc[:, 6:6+4].to_numpy().astype(np.float32).astype(int)
 
-    def parse_mms_sliding_info(info):
-        return parse_cis_format_annotation(info['MES_SLIDING'])
+        # first annotation with the highest score for each of AG/AL/DG/DL
+        grouped = scores.groupby(annotations.index.to_numpy())
+        best = grouped.idxmax()
 
+        parsed = pd.DataFrame({col: positions[best[col], i].astype(float) for i, col in enumerate(best.columns)}, index=best.index)
+        parsed.insert(0, 'score', grouped.max().max(axis=1))
+        return parsed
 
-    def parse_mes_vep_info(info):
-        max_annotation = -1
-        for annotation in info['CSQ']:
-            diff = annotation.split('|')[-2] # second last entry is "MaxEntScan_diff"
+    def parse_cis_info(annotations):
+        return parse_cis_format_annotations(annotations)
 
-            if diff == '' or diff == '.':
-                continue
-            max_annotation = max(max_annotation, abs(float(diff)))
-        
-        return (None, None) if max_annotation == -1 else (max_annotation, None)
+    def parse_spliceai_info(annotations):
+        # filter out annotations with '.' as score
+        scores = annotations.str.split('|', expand=True).iloc[:, 2:6]
+        return parse_cis_format_annotations(annotations[~(scores == '.').any(axis=1).to_numpy()])
 
-    def parse_squirls_info(info):
-        annotation = info['SQUIRLS_SCORE'][0]
-        max_annotation = -1
+    def parse_mms_sliding_info(annotations):
+        return parse_cis_format_annotations(annotations)
 
-        for _, score in map(lambda field: field.split('='), annotation.split('|')[1:]):
-            max_annotation = max(max_annotation, abs(float(score)))
+    def parse_mes_vep_info(annotations):
+        diff = annotations.str.rsplit('|', n=2).str[-2] # second last entry is "MaxEntScan_diff"
+        diff = diff.where(~diff.isin(['', '.'])).astype(float)
 
-        return (None, None) if max_annotation == -1 else (max_annotation, None)
+        return np.abs(diff).groupby(level=0).max().to_frame('score')
 
+    def parse_squirls_info(annotations):
+        # only the first allele; its fields are transcript=score
+        annotations = annotations.groupby(level=0).head(1)
+        scores = annotations.str.extractall(r'=([^|]*)')[0].astype(float)
 
+        return np.abs(scores).groupby(level=0).max().to_frame('score')
 
-    def append_from_vcf(predictions, fname, col_name, extract_fn):
-        # predictions[col_name] = None
-        with pysam.VariantFile(os.path.join('predictions', fname)) as f:
-            for row in f:
-                score, positions = extract_fn(row.info)
-                predictions.loc[row.id,col_name] = score
-                if positions is not None:
-                    for position, identifier in zip(positions, ['AG','AL','DG','DL']):
-                        df.loc[row.id,f'{col_name}_{identifier}'] = position
 
-        predictors.add(col_name)
-        return predictions
+    def append_from_vcf(predictions, fname, col_name, key, extract_fn):
+        ids, annotations = read_annotations(fname, key)
+        parsed = extract_fn(annotations).reindex(range(len(ids)))
+        parsed.index = ids
+        parsed = parsed[~ids.duplicated(keep='last')].reindex(predictions.index)
+
+        # assign each column once
+        predictions[col_name] = parsed.pop('score')
+        for identifier in parsed.columns:
+            predictions[f'{col_name}_{identifier}'] = parsed[identifier]
 
-    df = append_from_vcf(df, 'cis.vcf', 'CI-SpliceAI', parse_cis_info)
-    df = append_from_vcf(df, 'spliceai.vcf', 'SpliceAI', parse_spliceai_info)
-    df = append_from_vcf(df, 'mes_vep.vcf', 'MES (VEP)', parse_mes_vep_info)
-    df = append_from_vcf(df, 'mes_sliding.vcf', 'MES (Sliding)', parse_mms_sliding_info)
-    df = append_from_vcf(df, 'squirls.vcf', 'SQUIRLS', parse_squirls_info)
+        return predictions
 
 
 
     # ----- PARSE MMSplice TSV FILES -----
     # they don't write variant IDs, so we need to join data based on POS/REF/ALT
 
-    def append_from_mms_tsv(predictions, predictor, col_name):
+    def append_from_mms_tsv(predictions, predictor, col_name, chunk_size=1_000_000):
         f_in = os.path.join('predictions', f'mmsplice_{predictor}.tsv')
 
         # maps tsv values from output tsv to the col names from our csv
@@ -120,53 +123,251 @@ def aggregate():
 
 
         index_cols = [col for col in colmap.values() if col != col_name]
+        variants = pd.MultiIndex.from_frame(predictions.reset_index()[index_cols].astype(str))
 
-        df = pd.read_csv(f_in, sep='\t', dtype='str').filter(colmap.keys())
-        df.columns = colmap.values()
+        # read in chunks, only keeping rows of our variants, so large files never need to fit into memory
+        chunks = []
+        for chunk in pd.read_csv(f_in, sep='\t', dtype='str', usecols=lambda col: col in colmap, chunksize=chunk_size):
+            chunk = chunk.rename(columns=colmap)
+            chunks.append(chunk[pd.MultiIndex.from_frame(chunk[index_cols]).isin(variants)])
+        df = pd.concat(chunks)
 
         # convert to abs floats
         df[col_name] = np.abs(df[col_name].astype(float))
 
-        # Let's filter out duplicates
-        duplicates = df.groupby(index_cols)
-        df_filtered = pd.DataFrame()
-
-        for _, group in duplicates:
-            if len(group) == 1:
-                # one pred per variant!
-                df_filtered = pd.concat([df_filtered, group], sort=False)
-            else:
-                # take the biggest absolute value
-                df_filtered = pd.concat([df_filtered, group.loc[np.abs(group[col_name]).idxmax()].to_frame().T])
-
+        # Let's filter out duplicates (one pred per exon): take the biggest absolute value, the first one if tied
+        df_filtered = df.sort_values(col_name, ascending=False, kind='stable').drop_duplicates(index_cols)
         df_filtered['POS'] = df_filtered['POS'].astype(int)
-        df_filtered[col_name] = df_filtered[col_name].astype(float)
-
-        predictors.add(col_name)
 
         # join with main predictions file
         return predictions.reset_index().merge(df_filtered, on=index_cols, how='left', validate='one_to_one').set_index('ID')
 
-    predictions_mms = helpers.vcf_to_df(os.path.join('variants', 'variants_mmsplice.vcf'))
-    predictions_mms = append_from_mms_tsv(predictions_mms, 'pathogenicity', 'MMSplice (Pathogenicity)')
-    predictions_mms = append_from_mms_tsv(predictions_mms, 'splicing_efficiency', 'MMSplice (Splicing Efficiency)')
+    variants_mms_path = os.path.join('variants', 'variants_mmsplice.vcf')
+    predictions_mms = None
+
+    def append_from_mms(predictions, predictor, col_name):
+        nonlocal predictions_mms
+        if predictions_mms is None:
+            predictions_mms = helpers.vcf_to_df(variants_mms_path)
+
+        # join by ID with the other predictions
+        return predictions.join(append_from_mms_tsv(predictions_mms, predictor, col_name)[[col_name]])
+
+
+
+    # ----- INGEST -----
+    # every predictor with the files its columns are derived from; the ground truth is an input of all of them
+
+    sources = [
+        ('CI-SpliceAI', [os.path.join('predictions', 'cis.vcf')], lambda df: append_from_vcf(df, 'cis.vcf', 'CI-SpliceAI', ('CISpliceAI', 'CI-SpliceAI'), parse_cis_info)),
+        ('SpliceAI', [os.path.join('predictions', 'spliceai.vcf')], lambda df: append_from_vcf(df, 'spliceai.vcf', 'SpliceAI', 'SpliceAI', parse_spliceai_info)),
+        ('MES (VEP)', [os.path.join('predictions', 'mes_vep.vcf')], lambda df: append_from_vcf(df, 'mes_vep.vcf', 'MES (VEP)', 'CSQ', parse_mes_vep_info)),
+        ('MES (Sliding)', [os.path.join('predictions', 'mes_sliding.vcf')], lambda df: append_from_vcf(df, 'mes_sliding.vcf', 'MES (Sliding)', 'MES_SLIDING', parse_mms_sliding_info)),
+        ('SQUIRLS', [os.path.join('predictions', 'squirls.vcf')], lambda df: append_from_vcf(df, 'squirls.vcf', 'SQUIRLS', 'SQUIRLS_SCORE', parse_squirls_info)),
+        ('MMSplice (Pathogenicity)', [os.path.join('predictions', 'mmsplice_pathogenicity.tsv'), variants_mms_path], lambda df: append_from_mms(df, 'pathogenicity', 'MMSplice (Pathogenicity)')),
+        ('MMSplice (Splicing Efficiency)', [os.path.join('predictions', 'mmsplice_splicing_efficiency.tsv'), variants_mms_path], lambda df: append_from_mms(df, 'splicing_efficiency', 'MMSplice (Splicing Efficiency)')),
+    ]
 
-    # join by ID with the other predictions
-    df = df.join(predictions_mms.drop(columns=['#CHROM', 'POS', 'REF', 'ALT']))
+    previous = read_meta().get('inputs', {}) if incremental and os.path.isdir(store_path) else {}
+    predictors = []
+    inputs = {}
 
-    df.to_csv(os.path.join('predictions', 'joined', 'predictions.csv'))
+    for predictor, paths, ingest in sources:
+        paths = [variants_path] + paths
+        known = previous.get(predictor, {})
+        inputs[predictor] = fingerprints(paths, known)
 
-    with open(os.path.join('predictions', 'joined', 'predictors.txt'), 'w') as f:
+        if known.keys() == inputs[predictor].keys() and all(known[path]['sha256'] == inputs[predictor][path]['sha256'] for path in paths):
+            # unchanged, take over the stored columns
+            stored, _ = read([predictor] + [f'{predictor}_{identifier}' for identifier in ['AG', 'AL', 'DG', 'DL']])
+            for col in stored.columns:
+                df[col] = stored[col]
+        else:
+            print(f'Ingesting {predictor}')
+            df = ingest(df)
+
+        predictors.append(predictor)
+
+    # human-readable exports, written first so the store records their fingerprints
+    df.to_csv(csv_path)
+
+    with open(predictors_path, 'w') as f:
         f.write(','.join(predictors))
 
+    with locked():
+        write(df, predictors, inputs, exports=fingerprints([csv_path, predictors_path], {}))
 
-def read():
-    df = pd.read_csv(os.path.join('predictions', 'joined', 'predictions.csv')).set_index('ID')
 
-    with open(os.path.join('predictions', 'joined', 'predictors.txt'), 'r') as f:
-        predictors = f.readline().split(',')
+# ----- COLUMNAR STORE -----
+# one .npy file per column plus meta.json holding column names, dtypes and the predictor list
 
-    return df, predictors
+store_path = os.path.join('predictions', 'joined', 'store')
+csv_path = os.path.join('predictions', 'joined', 'predictions.csv')
+predictors_path = os.path.join('predictions', 'joined', 'predictors.txt')
+
+def fingerprints(paths, previous):
+    '''Size, modification time and content hash of each file; hashes are taken over from `previous` if size and mtime did not change'''
+    sys.path.append(os.path.abspath('.'))
+    from src import helpers
+
+    prints = {}
+    for path in paths:
+        stat = os.stat(path)
+        known = previous.get(path)
+        if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            prints[path] = known
+        else:
+            prints[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': helpers.file_hash(path)}
+    return prints
+
+def column_dtype(col, series, predictors):
+    '''Stored dtype of a column: bool labels, int32 variant positions, float64 scores, float32 predicted position offsets and fixed-width strings'''
+    if col == 'SpliceAffecting':
+        return np.dtype(bool)
+    if col == 'POS':
+        return np.dtype(np.int32)
+    if col in predictors:
+        return np.dtype(np.float64)
+    if col.rsplit('_', 1)[0] in predictors:
+        # offsets to the variant are small integers, which float32 holds exactly next to NaN for missing positions
+        return np.dtype(np.float32)
+    if series.dtype.kind in 'biuf':
+        return series.dtype
+    return np.dtype(str)
+
+def write(df, predictors, inputs=None, directory=store_path, exports=None):
+    '''
+    Writes the joined predictions into a columnar store; `inputs` are fingerprints of the files each predictor was ingested from,
+    `exports` those of the CSV export the store matches.
+    '''
+    # a temporary directory of this process, so concurrent writers do not remove each other's
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix=os.path.basename(directory) + '.', suffix='.tmp')
+
+    df = df.reset_index()
+    dtypes = {}
+    for i, col in enumerate(df.columns):
+        dtype = column_dtype(col, df[col], predictors)
+        values = df[col].to_numpy()
+
+        if dtype.kind == 'U':
+            # missing strings are stored empty, just as in the CSV
+            values = df[col].fillna('').astype(str).to_numpy().astype(str)
+        elif values.dtype == np.float32 and dtype != values.dtype:
+            # widen via the shortest decimal representation, so scores compare to thresholds as their CSV values did
+            values = values.astype(str).astype(dtype)
+        else:
+            values = values.astype(dtype)
+
+        np.save(os.path.join(tmp_directory, f'{i}.npy'), values)
+        dtypes[col] = values.dtype.str
+
+    meta = {'index': df.columns[0], 'columns': dtypes, 'predictors': predictors, 'inputs': inputs or {}, 'exports': exports or {}}
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+    return meta
+
+@contextlib.contextmanager
+def locked():
+    '''Serialises replacing the store between processes, e.g. analysis scripts that find it outdated at the same time'''
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    with open(store_path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def outdated(meta):
+    '''Fingerprints of the CSV export if the store does not match them (or does not exist), otherwise None'''
+    known = meta.get('exports', {}) if meta else {}
+    exports = fingerprints([csv_path, predictors_path], known)
+    if meta is None or known.keys() != exports.keys() or any(known[path]['sha256'] != exports[path]['sha256'] for path in exports):
+        return exports
+    return None
+
+def read_meta():
+    '''
+    Reads the meta data of the store. The store is (re)built from the CSV export if it does not exist or the export changed,
+    e.g. for the predictions checked into the repository.
+    '''
+    def load():
+        if not os.path.isdir(store_path):
+            return None
+        with open(os.path.join(store_path, 'meta.json'), 'r') as f:
+            return json.load(f)
+
+    meta = load()
+    if outdated(meta) is None:
+        return meta
+
+    with locked():
+        # another process may have rebuilt the store while this one waited
+        meta = load()
+        exports = outdated(meta)
+        if exports is not None:
+            df = pd.read_csv(csv_path).set_index('ID')
+            with open(predictors_path, 'r') as f:
+                predictors = f.readline().split(',')
+            meta = write(df, predictors, exports=exports)
+
+    return meta
+
+def from_store(values):
+    '''Copies stored values into memory; empty strings were missing values'''
+    if values.dtype.kind == 'U':
+        values = values.astype(object)
+        values[values == ''] = np.nan
+    return np.array(values)
+
+def read_predictors():
+    return read_meta()['predictors']
+
+def stored_columns(meta, columns):
+    '''
+    The given columns that exist in the store. Positions (AG/AL/DG/DL) of predictors without any are skipped,
+    any other unknown column raises a KeyError.
+    '''
+    names = list(meta['columns'])[1:]
+    positions = {f'{predictor}_{kind}' for predictor in meta['predictors'] for kind in ['AG', 'AL', 'DG', 'DL']}
+
+    unknown = [col for col in columns if col not in names and col not in positions]
+    if unknown:
+        raise KeyError(f'Columns not in the joined predictions: {", ".join(unknown)}')
+    return [col for col in columns if col in names]
+
+def read(columns=None):
+    '''
+    Reads the joined predictions (indexed by ID) and the list of predictors.
+    If `columns` is given only those are loaded, see `stored_columns`.
+    '''
+    meta = read_meta()
+    names = list(meta['columns'])
+
+    def load(name):
+        return from_store(np.load(os.path.join(store_path, f'{names.index(name)}.npy'), mmap_mode='r'))
+
+    if columns is None:
+        columns = names[1:]
+
+    df = pd.DataFrame({col: load(col) for col in stored_columns(meta, columns)}, index=pd.Index(load(meta['index']), name=meta['index']))
+    return df, meta['predictors']
+
+def read_chunks(columns, chunk_size=1_000_000):
+    '''Yields the given columns of the joined predictions in chunks of `chunk_size` rows, reading only one chunk at a time from the store'''
+    meta = read_meta()
+    names = list(meta['columns'])
+    columns = stored_columns(meta, columns)
+    mapped = {col: np.load(os.path.join(store_path, f'{names.index(col)}.npy'), mmap_mode='r') for col in columns}
+
+    n_rows = len(next(iter(mapped.values()))) if mapped else 0
+    for start in range(0, n_rows, chunk_size):
+        yield pd.DataFrame({col: from_store(values[start:start+chunk_size]) for col, values in mapped.items()})
 
 if __name__ == '__main__':
-    aggregate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Aggregates all predictions with ground truth into predictions/joined.')
+    parser.add_argument('-i', '--incremental', action='store_true', help='only re-ingest predictors whose input files changed since the last run')
+    args = parser.parse_args()
+
+    aggregate(args.incremental)
@@ -0,0 +1,90 @@
+'''
+Vectorised bootstrap of AUC-PR, AUC-ROC and accuracy.
+The scores of each predictor are sorted once; a replicate only changes how often each variant is drawn,
+so the curves of a whole batch of replicates follow from weighted cumulative sums at once.
+'''
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+METRICS = ['AUC-PR', 'AUC-ROC', 'Accuracy']
+
+def resample_weights(rng: np.random.Generator, n: int, n_replicates: int):
+    '''Draws `n_replicates` resamples of n indices with replacement; returns how often each index was drawn per replicate'''
+    indices = rng.integers(0, n, size=(n_replicates, n))
+    offsets = n * np.arange(n_replicates)[:, None]
+    return np.bincount((indices + offsets).ravel(), minlength=n_replicates * n).reshape(n_replicates, n)
+
+def curve_counts(scores: np.ndarray, labels: np.ndarray, weights: np.ndarray):
+    '''Weighted TP and FP of predicting `scores >= t` at every distinct score t (descending), for every row of `weights`'''
+    order = np.argsort(-scores, kind='stable')
+    scores, labels, weights = scores[order], labels[order], weights[:, order]
+
+    # cut after the last of equal scores
+    ends = np.append(scores[:-1] != scores[1:], True)
+    tp = np.cumsum(weights * labels, axis=1)[:, ends]
+    fp = np.cumsum(weights * ~labels, axis=1)[:, ends]
+    return tp, fp
+
+def trapezoid(x: np.ndarray, y: np.ndarray):
+    '''Area under the curves given by rows of x and y, both starting at the first point'''
+    return np.sum(np.diff(x, axis=1) * (y[:, 1:] + y[:, :-1]) / 2, axis=1)
+
+def auc_roc(tp: np.ndarray, fp: np.ndarray):
+    '''Same as sklearn's roc_auc_score; NaN if a replicate lacks either class'''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tpr = np.concatenate([np.zeros((len(tp), 1)), tp / tp[:, -1:]], axis=1)
+        fpr = np.concatenate([np.zeros((len(fp), 1)), fp / fp[:, -1:]], axis=1)
+    return trapezoid(fpr, tpr)
+
+def auc_pr(tp: np.ndarray, fp: np.ndarray):
+    '''Same as sklearn's auc(recall, precision) over precision_recall_curve; NaN if a replicate lacks positives'''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = tp / tp[:, -1:]
+        # scores that were not drawn at all sit on the curve's start point (recall 0, precision 1)
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1)
+
+    recall = np.concatenate([np.zeros((len(tp), 1)), recall], axis=1)
+    precision = np.concatenate([np.ones((len(tp), 1)), precision], axis=1)
+    return trapezoid(recall, precision)
+
+def replicate_chunk(scores: pd.DataFrame, labels: np.ndarray, thresholds: dict, seed: np.random.SeedSequence, n_replicates: int):
+    '''Metrics of `n_replicates` resamples, shared by all predictors; returns {metric: (n_replicates, predictors)}'''
+    weights = resample_weights(np.random.default_rng(seed), len(labels), n_replicates)
+    results = {metric: np.empty((n_replicates, scores.shape[1])) for metric in METRICS}
+
+    for i, predictor in enumerate(scores.columns):
+        predictor_scores = scores[predictor].to_numpy(dtype=float)
+        tp, fp = curve_counts(predictor_scores, labels, weights)
+
+        correct = (predictor_scores >= thresholds[predictor]) == labels
+        results['AUC-PR'][:, i] = auc_pr(tp, fp)
+        results['AUC-ROC'][:, i] = auc_roc(tp, fp)
+        results['Accuracy'][:, i] = weights @ correct / len(labels)
+
+    return results
+
+def bootstrap(scores: pd.DataFrame, labels, thresholds: dict, n_replicates: int = 10000, workers: int = 1, seed: int = 0, chunk_size: int = None):
+    '''
+    Bootstraps AUC-PR, AUC-ROC and accuracy at the given thresholds for every predictor (column of `scores`, without missing values).
+    Replicates are computed in chunks of `chunk_size` (by default about 10M resampled variants each), in a process pool if `workers` is not 1 (0 uses all cores).
+    Returns {metric: frame of n_replicates x predictors}.
+    '''
+    labels = np.asarray(labels, dtype=bool)
+    chunk_size = chunk_size or max(1, 10_000_000 // len(labels))
+    sizes = [min(chunk_size, n_replicates - start) for start in range(0, n_replicates, chunk_size)]
+    tasks = [(scores, labels, thresholds, chunk_seed, size) for chunk_seed, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes)]
+
+    if workers == 1:
+        chunks = [replicate_chunk(*task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+            chunks = pool.starmap(replicate_chunk, tasks)
+
+    return {metric: pd.DataFrame(np.concatenate([chunk[metric] for chunk in chunks]), columns=scores.columns) for metric in METRICS}
+
+def confidence_intervals(replicates: dict, level: float = .95):
+    '''Percentile intervals per metric and predictor; returns {metric: frame with rows low/high}'''
+    quantiles = [(1 - level) / 2, (1 + level) / 2]
+    return {metric: values.quantile(quantiles).set_axis(['low', 'high']) for metric, values in replicates.items()}
@@ -16,7 +16,7 @@ cmap = cm.get_cmap('tab10') # default colour map
 sys.path.append(os.path.abspath('.'))
 from src.binning import Binning
 
-df, _ = aggregate_predictions.read()
+df, _ = aggregate_predictions.read(['CI-SpliceAI', 'SpliceAffecting'])
 
 # use the optimal threshold derived by prauc-threshold-accuracy analysis
 threshold = pd.read_csv(os.path.join('analysis', 'predictions', 'prauc-threshold-accuracy.csv')).set_index('Algorithm')['Optimal Threshold']['CI-SpliceAI']
@@ -31,11 +31,21 @@ fig, ax = plt.subplots(figsize=(15, 5))
 # first draw donor, then acceptor
 acceptor_offset = len(bins.x)
 
+# count fn/fp per bin in one pass
+is_acceptor = bins.df['Closest SS Acceptor']
+is_fp, is_fn = bins.df.index.isin(fp.index), bins.df.index.isin(fn.index)
+counts = bins.bin_subsets(bins.df['Closest SS Offset'], {
+    'donor_fp': ~is_acceptor & is_fp,
+    'donor_fn': ~is_acceptor & is_fn,
+    'acceptor_fp': is_acceptor & is_fp,
+    'acceptor_fn': is_acceptor & is_fn,
+})
+
 # draw fn/fp bars
-donor_fp = bins.draw_bin_counts(ax, bins.closest_is_donor.filter(fp.index, axis=0)['Closest SS Offset'], -.2, 'False Positive', color=cmap.colors[0], width=.4)
-donor_fn = bins.draw_bin_counts(ax, bins.closest_is_donor.filter(fn.index, axis=0)['Closest SS Offset'], .2, 'False Negative', color=cmap.colors[1], width=.4)
-acceptor_fp = bins.draw_bin_counts(ax, bins.closest_is_acceptor.filter(fp.index, axis=0)['Closest SS Offset'], acceptor_offset-.2, None, color=cmap.colors[0], width=.4)
-acceptor_fn = bins.draw_bin_counts(ax, bins.closest_is_acceptor.filter(fn.index, axis=0)['Closest SS Offset'], acceptor_offset+.2, None, color=cmap.colors[1], width=.4)
+donor_fp = bins.draw_counts(ax, counts['donor_fp'], -.2, 'False Positive', color=cmap.colors[0], width=.4)
+donor_fn = bins.draw_counts(ax, counts['donor_fn'], .2, 'False Negative', color=cmap.colors[1], width=.4)
+acceptor_fp = bins.draw_counts(ax, counts['acceptor_fp'], acceptor_offset-.2, None, color=cmap.colors[0], width=.4)
+acceptor_fn = bins.draw_counts(ax, counts['acceptor_fn'], acceptor_offset+.2, None, color=cmap.colors[1], width=.4)
 
 # draw intron/exon doodles
 draw_height = ax.get_ylim()[1] * .075
@@ -0,0 +1,221 @@
+'''
+Out-of-core PR/ROC metrics from score histograms.
+Predictions are streamed from the joined store in chunks and counted per predictor, split by SpliceAffecting;
+histograms of shards (e.g. built on different nodes) add up, and all metrics are derived from the merged counts.
+
+Usage (cwd is expected to be project root):
+    python src/analysis/predictions/histograms.py -o shard.npz
+    python src/analysis/predictions/histograms.py --merge shard1.npz shard2.npz -o merged.npz
+    python src/analysis/predictions/histograms.py --check
+'''
+import argparse
+import numpy as np
+import pandas as pd
+import aggregate_predictions
+import bootstrap
+
+def fill_scores(scores: pd.Series):
+    '''
+    Scores as the in-memory metrics use them: missing (NaN) scores count as 0, infinite ones as twice the highest
+    and negative infinite ones as below the lowest finite score.
+    '''
+    filled = scores.fillna(0)
+    finite = filled[np.isfinite(filled)]
+    filled[filled == np.inf] = 2 * max(finite)
+    filled[filled == -np.inf] = min(finite) - 1
+    return filled
+
+class ScoreHistogram():
+    '''
+        Counts of one predictor's scores, split by label. Only occupied bins are kept.
+        By default (resolution 0) every distinct score is its own bin, so all metrics equal the in-memory ones;
+        memory grows with the number of distinct scores, which stays small for predictors reporting a few decimals.
+        A `resolution` > 0 rounds scores to its multiples, bounding memory by the score range. That is approximate:
+        thresholds move by up to resolution/2, and scores within one bin become ties, which changes AUC-ROC
+        by at most half the fraction of affecting/non-affecting pairs sharing a bin. AUC-PR can change more where many scores
+        crowd into few bins, e.g. by 0.4 percentage points for MMSplice (Pathogenicity) near 1 at a resolution of 1e-4.
+        Like the in-memory metrics (see `fill_scores`), missing (NaN) scores count as 0, infinite ones as higher
+        and negative infinite ones as lower than any other score.
+    '''
+    def __init__(self, resolution: float = 0):
+        self.resolution = resolution
+        self.bins = np.zeros(0) # scores, rounded to multiples of the resolution if there is one
+        self.counts = np.zeros((0, 2), dtype=np.int64) # per bin: not affecting / affecting splicing
+        self.missing = np.zeros(2, dtype=np.int64)
+        self.infinite = np.zeros(2, dtype=np.int64)
+        self.negative_infinite = np.zeros(2, dtype=np.int64)
+
+    def key(self, scores):
+        '''Bins of finite scores'''
+        if not self.resolution:
+            return np.asarray(scores, dtype=float)
+        return np.round(np.asarray(scores, dtype=float) / self.resolution) * self.resolution
+
+    def _add_bins(self, bins: np.ndarray, counts: np.ndarray):
+        self.bins, inverse = np.unique(np.concatenate([self.bins, bins]), return_inverse=True)
+        merged = np.zeros((len(self.bins), 2), dtype=np.int64)
+        np.add.at(merged, inverse, np.concatenate([self.counts, counts]))
+        self.counts = merged
+
+    def add(self, scores, labels):
+        '''Counts a chunk of scores with their labels'''
+        scores = np.asarray(scores, dtype=float)
+        labels = np.asarray(labels, dtype=bool).astype(np.int64)
+
+        self.missing += np.bincount(labels[np.isnan(scores)], minlength=2)
+        self.infinite += np.bincount(labels[np.isposinf(scores)], minlength=2)
+        self.negative_infinite += np.bincount(labels[np.isneginf(scores)], minlength=2)
+
+        finite = np.isfinite(scores)
+        bins, inverse = np.unique(self.key(scores[finite]), return_inverse=True)
+        counts = np.zeros((len(bins), 2), dtype=np.int64)
+        np.add.at(counts, (inverse, labels[finite]), 1)
+        self._add_bins(bins, counts)
+        return self
+
+    def __iadd__(self, other: 'ScoreHistogram'):
+        assert self.resolution == other.resolution, 'Histograms of different resolution cannot be merged'
+        self._add_bins(other.bins, other.counts)
+        self.missing += other.missing
+        self.infinite += other.infinite
+        self.negative_infinite += other.negative_infinite
+        return self
+
+    def coverage(self):
+        return 1 - self.missing.sum() / (self.counts.sum() + self.missing.sum() + self.infinite.sum() + self.negative_infinite.sum())
+
+    def curve(self):
+        '''
+        Thresholds (descending, the infinite bin first and the negative infinite one last) and TP/FP of predicting
+        `score >= threshold` at each of them. Missing scores are merged into the bin of 0.
+        '''
+        bins, inverse = np.unique(np.append(self.bins, 0), return_inverse=True)
+        counts = np.zeros((len(bins), 2), dtype=np.int64)
+        np.add.at(counts, inverse, np.concatenate([self.counts, self.missing[None]]))
+
+        thresholds = np.concatenate([[np.inf], bins[::-1], [-np.inf]])
+        counts = np.concatenate([self.infinite[None], counts[::-1], self.negative_infinite[None]])
+        return thresholds, np.cumsum(counts[:, 1]), np.cumsum(counts[:, 0])
+
+    def auc_pr(self):
+        _, tp, fp = self.curve()
+        return bootstrap.auc_pr(tp[None], fp[None])[0]
+
+    def auc_roc(self):
+        _, tp, fp = self.curve()
+        return bootstrap.auc_roc(tp[None], fp[None])[0]
+
+    def precision_recall(self):
+        '''Precision and recall in the order of sklearn's precision_recall_curve'''
+        _, tp, fp = self.curve()
+        valid = tp + fp > 0
+        precision, recall = tp[valid] / (tp + fp)[valid], tp[valid] / tp[-1]
+        return np.append(precision[::-1], 1), np.append(recall[::-1], 0)
+
+    def accuracy(self, threshold: float):
+        thresholds, tp, fp = self.curve()
+        n_pos, n_neg = tp[-1], fp[-1]
+
+        # cut below the lowest bin that is still predicted positive
+        cut = np.searchsorted(-thresholds, -self.key(threshold), side='right') - 1
+        if cut < 0:
+            return n_neg / (n_pos + n_neg)
+        return (tp[cut] + n_neg - fp[cut]) / (n_pos + n_neg)
+
+    def optimal_threshold(self):
+        '''Finite score with the highest accuracy as threshold, where missing scores are never positive; ties go to the lowest'''
+        if not len(self.bins):
+            return np.nan
+
+        tp = self.infinite[1] + np.cumsum(self.counts[::-1, 1])
+        fp = self.infinite[0] + np.cumsum(self.counts[::-1, 0])
+        correct = tp + self.counts[:, 0].sum() + self.missing[0] + self.infinite[0] + self.negative_infinite[0] - fp
+        return self.bins[::-1][len(correct) - 1 - np.argmax(correct[::-1])]
+
+
+def accumulate(chunks, predictors: list, resolution: float = 0):
+    '''Builds histograms of all predictors from an iterable of frames holding their scores and SpliceAffecting'''
+    histograms = {predictor: ScoreHistogram(resolution) for predictor in predictors}
+    for chunk in chunks:
+        for predictor, histogram in histograms.items():
+            histogram.add(chunk[predictor], chunk.SpliceAffecting)
+    return histograms
+
+def merge(*shards: dict):
+    '''Adds up histograms of several shards; all must hold the same predictors'''
+    merged = {predictor: ScoreHistogram(histogram.resolution) for predictor, histogram in shards[0].items()}
+    for shard in shards:
+        for predictor, histogram in shard.items():
+            merged[predictor] += histogram
+    return merged
+
+def save(path: str, histograms: dict):
+    arrays = {'predictors': np.array(list(histograms), dtype=str)}
+    for i, histogram in enumerate(histograms.values()):
+        arrays.update({
+            f'{i}_resolution': histogram.resolution,
+            f'{i}_bins': histogram.bins,
+            f'{i}_counts': histogram.counts,
+            f'{i}_missing': histogram.missing,
+            f'{i}_infinite': histogram.infinite,
+            f'{i}_negative_infinite': histogram.negative_infinite,
+        })
+    np.savez(path, **arrays)
+
+def load(path: str):
+    histograms = {}
+    with np.load(path) as f:
+        for i, predictor in enumerate(f['predictors']):
+            histogram = ScoreHistogram(float(f[f'{i}_resolution']))
+            histogram.bins, histogram.counts = f[f'{i}_bins'], f[f'{i}_counts']
+            histogram.missing, histogram.infinite, histogram.negative_infinite = f[f'{i}_missing'], f[f'{i}_infinite'], f[f'{i}_negative_infinite']
+            histograms[str(predictor)] = histogram
+    return histograms
+
+def check(n: int = 10000, seed: int = 0):
+    '''Asserts that coverage, AUC-PR and AUC-ROC of a histogram equal sklearn's on the filled scores, with NaN, +inf and -inf among them'''
+    from sklearn.metrics import auc, precision_recall_curve, roc_auc_score
+
+    rng = np.random.default_rng(seed)
+    labels = rng.random(n) < .3
+    # few distinct values, so there are ties, and scores below 0 for the negative infinite ones to sit under
+    scores = np.round(rng.normal(labels.astype(float), 1), 2)
+    scores[rng.random(n) < .05] = np.nan
+    scores[rng.random(n) < .02] = np.inf
+    scores[rng.random(n) < .02] = -np.inf
+
+    # shards merge into the same histogram as one pass
+    halves = [ScoreHistogram().add(scores[part], labels[part]) for part in (slice(None, n // 2), slice(n // 2, None))]
+    histogram = merge(*[{'check': half} for half in halves])['check']
+
+    filled = fill_scores(pd.Series(scores))
+    precision, recall, _ = precision_recall_curve(labels, filled)
+    assert np.isclose(histogram.coverage(), np.mean(~np.isnan(scores)))
+    assert np.isclose(histogram.auc_pr(), auc(recall, precision)), 'AUC-PR differs'
+    assert np.isclose(histogram.auc_roc(), roc_auc_score(labels, filled)), 'AUC-ROC differs'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds (or merges) per-predictor score histograms of the joined predictions.')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--merge', nargs='+', help='merge these histogram files instead of reading the predictions')
+    parser.add_argument('-r', '--resolution', type=float, default=0, help='round scores to multiples of this, which is approximate (see ScoreHistogram); 0 keeps every distinct score')
+    parser.add_argument('-c', '--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--check', action='store_true', help='check that the metrics of histograms equal the in-memory ones, on random scores with NaN and infinite values')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        print('Histogram metrics equal the in-memory ones')
+        raise SystemExit
+
+    if args.output is None:
+        parser.error('the following arguments are required: -o/--output')
+
+    if args.merge:
+        histograms = merge(*map(load, args.merge))
+    else:
+        predictors = aggregate_predictions.read_predictors()
+        histograms = accumulate(aggregate_predictions.read_chunks(predictors + ['SpliceAffecting'], args.chunk_size), predictors, args.resolution)
+
+    save(args.output, histograms)
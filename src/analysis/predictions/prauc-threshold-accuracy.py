@@ -3,49 +3,62 @@ Creates the table holding PR-AUC, optimal threshold and acccuracy; creates the P
 cwd is expected to be project root
 '''
 
+import argparse
 import pandas as pd
 import os
 import numpy as np
 from sklearn.metrics import precision_recall_curve, auc, accuracy_score, roc_auc_score
 import matplotlib.pyplot as plt
 import aggregate_predictions
-
-predictions, predictors = aggregate_predictions.read()
+import bootstrap
+import histograms
+from thresholds import best_thresholds
+
+parser = argparse.ArgumentParser(description='Creates the PR-AUC/threshold/accuracy table with bootstrap confidence intervals and the PR-AUC graph.')
+parser.add_argument('-b', '--bootstrap', type=int, default=10000, help='number of bootstrap replicates')
+parser.add_argument('-w', '--workers', type=int, default=1, help='processes computing replicates; 0 uses all cores')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--streaming', action='store_true', help='derive all metrics from score histograms streamed from the joined store, without confidence intervals; memory grows with the number of distinct scores rather than variants')
+parser.add_argument('--histograms', nargs='+', help='derive all metrics from these merged histogram files (see histograms.py) instead of the predictions')
+parser.add_argument('-r', '--resolution', type=float, default=0, help='round scores of --streaming to multiples of this to bound memory; metrics are then approximate (see histograms.ScoreHistogram)')
+parser.add_argument('-c', '--chunk-size', type=int, default=1_000_000, help='rows read at once by --streaming')
+args = parser.parse_args()
+streaming = args.streaming or args.histograms is not None
+
+if streaming:
+    if args.histograms:
+        score_histograms = histograms.merge(*map(histograms.load, args.histograms))
+    else:
+        predictors = aggregate_predictions.read_predictors()
+        chunks = aggregate_predictions.read_chunks(predictors + ['SpliceAffecting'], args.chunk_size)
+        score_histograms = histograms.accumulate(chunks, predictors, args.resolution)
+    predictors = list(score_histograms)
+else:
+    predictions, predictors = aggregate_predictions.read(aggregate_predictions.read_predictors() + ['SpliceAffecting'])
 
 # ----- OPTIMAL THRESHOLDS -----
 
-# calculate them
-def calc_optimal_thresh(model_scores, labels):
-    numerical = ~np.isnan(model_scores) & np.isfinite(model_scores)
-    precision, recall, threshs = precision_recall_curve(labels[numerical], model_scores[numerical])
-
-    accuracies_per_thresh = np.zeros_like(threshs)
-    
-    for i, thresh in enumerate(threshs):
-        accuracies_per_thresh[i] = accuracy_score(labels, model_scores >= thresh)
-    
-    best_thresh = threshs[np.argmax(accuracies_per_thresh)]
-    
-    return best_thresh
-
-   
-optimal_thresholds = {}
-
-for predictor in predictors:
-    optimal_thresholds[predictor] = calc_optimal_thresh(predictions[predictor], predictions.SpliceAffecting)
+if streaming:
+    optimal_thresholds = {predictor: histogram.optimal_threshold() for predictor, histogram in score_histograms.items()}
+else:
+    # calculate them for all predictors in one pass over the sorted scores
+    thresholds = best_thresholds(predictions[predictors], predictions.SpliceAffecting)
+    optimal_thresholds = thresholds.loc['accuracy'].to_dict()
+    print(f'Thresholds optimal by metric:\n{thresholds.to_string()}')
 
 print(f'Optimal thresholds: {optimal_thresholds}')
 
 # ----- PR-AUC AND ACCURACY -----
 def get_scores(data):
     table = pd.DataFrame()
+    filled = {}
 
     for predictor in predictors:
         coverage = (~pd.isna(data[predictor])).sum().astype(float) / len(data)
 
         # fill missing predictions with 0
-        data_filled = data[predictor].fillna(0)
-        data_filled[data_filled == np.inf] = 2 * max(data_filled[np.isfinite(data_filled)])
+        data_filled = histograms.fill_scores(data[predictor])
+        filled[predictor] = data_filled
       
         accuracy_optimal = accuracy_score(data.SpliceAffecting, data_filled >= optimal_thresholds[predictor])
 
@@ -63,10 +76,33 @@ def get_scores(data):
 
         table.index.name = 'Algorithm'
 
+    # bootstrap confidence intervals
+    replicates = bootstrap.bootstrap(pd.DataFrame(filled), data.SpliceAffecting, optimal_thresholds, n_replicates=args.bootstrap, workers=args.workers, seed=args.seed)
+    for metric, interval in bootstrap.confidence_intervals(replicates).items():
+        table[f'{metric} 95% CI'] = pd.Series({
+            predictor: '%.2f%% - %.2f%%' % (interval[predictor]['low']*100, interval[predictor]['high']*100)
+            for predictor in predictors
+        })
 
     return table.sort_values(['AUC-PR', 'AUC-ROC', 'Accuracy'], ascending=True)
 
-table = get_scores(predictions).filter(['Coverage', 'AUC-PR', 'AUC-ROC', 'Optimal Threshold', 'Accuracy'])
+def get_histogram_scores(score_histograms):
+    '''Same as `get_scores`, but from score histograms and without confidence intervals'''
+    table = pd.DataFrame({
+        predictor: {
+            'Coverage': '%.0f%%' % (histogram.coverage()*100),
+            'AUC-PR': '%.2f%%' % (histogram.auc_pr()*100),
+            'AUC-ROC': '%.2f%%' % (histogram.auc_roc()*100),
+            'Optimal Threshold': '%.3f' % optimal_thresholds[predictor],
+            'Accuracy': '%.2f%%' % (histogram.accuracy(optimal_thresholds[predictor])*100),
+        }
+        for predictor, histogram in score_histograms.items()
+    }).T
+    table.index.name = 'Algorithm'
+
+    return table.sort_values(['AUC-PR', 'AUC-ROC', 'Accuracy'], ascending=True)
+
+table = (get_histogram_scores(score_histograms) if streaming else get_scores(predictions)).filter(['Coverage', 'AUC-PR', 'AUC-PR 95% CI', 'AUC-ROC', 'AUC-ROC 95% CI', 'Optimal Threshold', 'Accuracy', 'Accuracy 95% CI'])
 print(table)
 # print(table.to_latex())
 table.to_latex(os.path.join('analysis', 'predictions', 'prauc-threshold-accuracy.tex'))
@@ -77,8 +113,7 @@ table.to_markdown(os.path.join('analysis', 'predictions', 'prauc-threshold-accur
 # Calc PR-Curves
 def p_r_auc(predictor, data):
     # fill nan with 0 and inf with 2*max
-    data_filled = data[predictor].fillna(0)
-    data_filled[data_filled == np.inf] = 2 * max(data_filled[np.isfinite(data_filled)])
+    data_filled = histograms.fill_scores(data[predictor])
     
     precision, recall, _ = precision_recall_curve(data.SpliceAffecting, data_filled)
 
@@ -88,8 +123,17 @@ def p_r_auc(predictor, data):
         'auc': auc(recall, precision)
     }
 
+def p_r_auc_histogram(histogram):
+    precision, recall = histogram.precision_recall()
+
+    return {
+        'precision': precision,
+        'recall': recall,
+        'auc': histogram.auc_pr()
+    }
+
 p_r_aucs = pd.DataFrame({
-    predictor: p_r_auc(predictor, predictions)
+    predictor: p_r_auc_histogram(score_histograms[predictor]) if streaming else p_r_auc(predictor, predictions)
     for predictor in predictors
 })
 
@@ -14,7 +14,7 @@ from src.binning import Binning
 
 cmap = cm.get_cmap('tab10') # default colour map
 
-predictions, predictors = aggregate_predictions.read()
+predictions, predictors = aggregate_predictions.read(['SpliceAI', 'CI-SpliceAI', 'SpliceAffecting'])
 
 # Calculate predictive error and compare them between SpliceAI and CI-SpliceAI
 error_spliceai = abs(predictions['SpliceAI']-predictions.SpliceAffecting)
@@ -37,11 +37,21 @@ def plot_bins(ax):
     # first draw donor, then acceptor
     acceptor_offset = len(bins.x)
 
+    # count improved/decreased per bin in one pass
+    is_acceptor = bins.df['Closest SS Acceptor']
+    is_improved, is_decreased = bins.df.index.isin(improved.index), bins.df.index.isin(decreased.index)
+    counts = bins.bin_subsets(bins.df['Closest SS Offset'], {
+        'donor_improved': ~is_acceptor & is_improved,
+        'donor_decreased': ~is_acceptor & is_decreased,
+        'acceptor_improved': is_acceptor & is_improved,
+        'acceptor_decreased': is_acceptor & is_decreased,
+    })
+
     # draw fn/fp bars
-    donor_improved = bins.draw_bin_counts(ax, bins.closest_is_donor.filter(improved.index, axis=0)['Closest SS Offset'], -.2, 'Predictive Error Decreased', color=cmap.colors[0], width=.4)
-    donor_decreased = bins.draw_bin_counts(ax, bins.closest_is_donor.filter(decreased.index, axis=0)['Closest SS Offset'], .2, 'Predictive Error Increased', color=cmap.colors[1], width=.4)
-    acceptor_improved = bins.draw_bin_counts(ax, bins.closest_is_acceptor.filter(improved.index, axis=0)['Closest SS Offset'], acceptor_offset-.2, None, color=cmap.colors[0], width=.4)
-    acceptor_decreased = bins.draw_bin_counts(ax, bins.closest_is_acceptor.filter(decreased.index, axis=0)['Closest SS Offset'], acceptor_offset+.2, None, color=cmap.colors[1], width=.4)
+    donor_improved = bins.draw_counts(ax, counts['donor_improved'], -.2, 'Predictive Error Decreased', color=cmap.colors[0], width=.4)
+    donor_decreased = bins.draw_counts(ax, counts['donor_decreased'], .2, 'Predictive Error Increased', color=cmap.colors[1], width=.4)
+    acceptor_improved = bins.draw_counts(ax, counts['acceptor_improved'], acceptor_offset-.2, None, color=cmap.colors[0], width=.4)
+    acceptor_decreased = bins.draw_counts(ax, counts['acceptor_decreased'], acceptor_offset+.2, None, color=cmap.colors[1], width=.4)
 
     # draw intron/exon doodles
     draw_height = ax.get_ylim()[1] * .075
@@ -0,0 +1,57 @@
+'''
+Single-pass threshold search.
+Sorts the scores of each predictor once and derives TP/FP/TN/FN at every cut from cumulative sums,
+instead of re-evaluating the full label vector for every candidate threshold.
+'''
+import numpy as np
+import pandas as pd
+
+def sweep(scores, labels):
+    '''
+    Confusion counts of predicting `scores >= threshold` at every distinct finite score, for one or many predictors at once.
+    `scores` is (n,) or (n, predictors); missing (NaN) scores are never predicted positive.
+    Returns the thresholds, a mask of valid cuts and TP/FP/TN/FN, each (n, predictors) in order of descending score.
+    '''
+    scores = np.asarray(scores, dtype=float).reshape(len(labels), -1)
+    labels = np.asarray(labels, dtype=bool)
+
+    # NaN is sorted last, so it ends up on the negative side of every cut
+    order = np.argsort(-scores, axis=0, kind='stable')
+    thresholds = np.take_along_axis(scores, order, axis=0)
+    sorted_labels = labels[order]
+
+    tp = np.cumsum(sorted_labels, axis=0)
+    fp = np.cumsum(~sorted_labels, axis=0)
+    n_pos = labels.sum()
+    n_neg = len(labels) - n_pos
+
+    # only cut after the last of equal scores, and only at finite ones
+    valid = np.isfinite(thresholds)
+    valid[:-1] &= thresholds[:-1] != thresholds[1:]
+
+    return thresholds, valid, {'tp': tp, 'fp': fp, 'tn': n_neg - fp, 'fn': n_pos - tp}
+
+def best_thresholds(scores: pd.DataFrame, labels):
+    '''
+    Thresholds maximising accuracy, F1 and Youden's J per predictor (column of `scores`); ties go to the lowest threshold.
+    Returns a frame with one row per metric and one column per predictor.
+    '''
+    thresholds, valid, counts = sweep(scores.to_numpy(), labels)
+    tp, fp, tn, fn = counts['tp'], counts['fp'], counts['tn'], counts['fn']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'accuracy': tp + tn,
+            'f1': 2 * tp / (2 * tp + fp + fn),
+            'youden': tp / (tp + fn) - fp / (fp + tn),
+        }
+
+    optimal = {}
+    for metric, values in metrics.items():
+        values = np.where(valid & ~np.isnan(values), values, -np.inf)[::-1]
+        best = len(values) - 1 - np.argmax(values, axis=0)
+
+        chosen = thresholds[best, np.arange(thresholds.shape[1])]
+        optimal[metric] = np.where(valid.any(axis=0), chosen, np.nan)
+
+    return pd.DataFrame(optimal, index=scores.columns).T
@@ -7,7 +7,10 @@ import pandas as pd
 import aggregate_predictions
 import os
 
-predictions, predictors = aggregate_predictions.read()
+# only load ground truth and predicted positions
+predictors = aggregate_predictions.read_predictors()
+kinds = ['AG', 'AL', 'DG', 'DL']
+predictions, _ = aggregate_predictions.read(['POS'] + kinds + [f'{algo}_{kind}' for algo in predictors for kind in kinds])
 
 def position_accuracy(kind, algo, data):
     # only look at data with annotated ground truth
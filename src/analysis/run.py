@@ -0,0 +1,74 @@
+# this script is executed by analysis.sh. cwd is expected to be project root
+# it runs all analyses as stages of a pipeline, skipping those that are up to date, see src/pipeline.py
+
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+from src import pipeline
+from src.pipeline import Runner, Task
+from src.junctions import annotation_path
+
+HG = os.path.join('third-party', 'hg', 'hg38.fa')
+VARIANTS = os.path.join('variants', 'variants.csv')
+PREDICTIONS = ['predictions/cis.vcf', 'predictions/spliceai.vcf', 'predictions/mes_vep.vcf', 'predictions/mes_sliding.vcf', 'predictions/squirls.vcf',
+    'predictions/mmsplice_pathogenicity.tsv', 'predictions/mmsplice_splicing_efficiency.tsv', 'variants/variants_mmsplice.vcf']
+JOINED = ['predictions/joined/predictions.csv', 'predictions/joined/predictors.txt']
+
+# modules shared by the scripts, hashed as their sources
+AGGREGATE = 'src/analysis/predictions/aggregate_predictions.py'
+BINNING = ['src/binning.py', 'src/junctions.py', 'src/helpers.py']
+
+
+def script(path: str, *args: str):
+    return ' '.join(['python', path, *args])
+
+
+tasks = [
+    # visualise clinical data, but no predictions
+    Task('pies', script('src/analysis/variants/pies.py'),
+        [VARIANTS], ['analysis/variants/pies.eps', 'analysis/variants/pies.png'],
+        sources=['src/analysis/variants/pies.py']),
+    Task('distance-label', script('src/analysis/variants/distance-label.py'),
+        [VARIANTS, annotation_path], ['analysis/variants/distance-label.eps', 'analysis/variants/distance-label.png', 'analysis/variants/consensus_regions.txt'],
+        memory_gb=2, sources=['src/analysis/variants/distance-label.py'] + BINNING),
+
+    # aggregate predictions; predictors whose prediction files did not change are taken over from the store
+    Task('aggregate', script(AGGREGATE, '--incremental'),
+        [VARIANTS] + PREDICTIONS, JOINED + ['predictions/joined/store'],
+        memory_gb=4, sources=[AGGREGATE, 'src/helpers.py']),
+
+    # and create all tables and figures
+    Task('prauc', script('src/analysis/predictions/prauc-threshold-accuracy.py'),
+        JOINED, ['analysis/predictions/pr-auc.eps', 'analysis/predictions/pr-auc.png', 'analysis/predictions/prauc-threshold-accuracy.csv',
+            'analysis/predictions/prauc-threshold-accuracy.md', 'analysis/predictions/prauc-threshold-accuracy.tex'],
+        memory_gb=2, sources=['src/analysis/predictions/prauc-threshold-accuracy.py', 'src/analysis/predictions/bootstrap.py',
+            'src/analysis/predictions/histograms.py', 'src/analysis/predictions/thresholds.py', AGGREGATE]),
+    Task('predictive-errors', script('src/analysis/predictions/predictive-errors.py'),
+        JOINED + [annotation_path], ['analysis/predictions/predictive-error-change.txt', 'analysis/predictions/predictive-errors.png'],
+        memory_gb=2, sources=['src/analysis/predictions/predictive-errors.py', AGGREGATE] + BINNING),
+    Task('variant-effects', script('src/analysis/predictions/variant-effects.py'),
+        JOINED, ['analysis/predictions/variant-effects.tex', 'analysis/predictions/variant-effects.md'],
+        sources=['src/analysis/predictions/variant-effects.py', AGGREGATE]),
+    # uses the optimal threshold of CI-SpliceAI from the PR-AUC table
+    Task('cis-fp-fn', script('src/analysis/predictions/cis-fp-fn.py'),
+        JOINED + [annotation_path, 'analysis/predictions/prauc-threshold-accuracy.csv'], ['analysis/predictions/cis-fp-fn.eps', 'analysis/predictions/cis-fp-fn.png'],
+        memory_gb=2, sources=['src/analysis/predictions/cis-fp-fn.py', AGGREGATE] + BINNING),
+]
+
+CFTR_SOURCES = ['src/analysis/splicing/' + name for name in ['CFTR.py', 'ml_data.py', 'draw_gene.py', 'models.py', 'tiling.py']] +\
+    ['src/junctions.py', 'src/genome.py', 'src/codec.py', 'src/helpers.py']
+
+
+if __name__ == '__main__':
+    parser = pipeline.argument_parser('Creates all tables and figures, independent ones concurrently.', os.path.join('logs', 'analysis'))
+    args = parser.parse_args()
+
+    runner = Runner.from_args(args)
+
+    # visualise splice site predictions on CFTR (not variants); the SpliceAI ensemble shares all cores among its models
+    tasks.append(Task('CFTR', script('src/analysis/splicing/CFTR.py'),
+        [HG, 'src/CI-SpliceAI-TRAIN.pb', annotation_path], ['analysis/splicing/CFTR.eps', 'analysis/splicing/CFTR.png', 'analysis/splicing/stats.txt'],
+        cpus=runner.cpus, memory_gb=8, sources=CFTR_SOURCES))
+
+    pipeline.main(runner, tasks, args.only)
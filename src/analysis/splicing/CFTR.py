@@ -6,32 +6,35 @@ Therefore both algorithms did not see this gene before.
 
 from pkg_resources import resource_filename
 import os
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import ml_data
 import draw_gene
-import keras
+import models
+import tiling
 from cispliceai.model import CISpliceAI
+from src.junctions import Junctions # ml_data adds the project root to the path
 
-annotation_table = pd.read_csv(resource_filename('cispliceai', os.path.join('data', 'grch38.csv'))).set_index('gene_id')
+gene = Junctions().gene('ENSG00000001626') # CFTR gene
 
-annotation_table.jn_start = annotation_table.jn_start.map(lambda i: list(map(int, i.split(','))))
-annotation_table.jn_end = annotation_table.jn_end.map(lambda i: list(map(int, i.split(','))))
-gene = annotation_table.loc['ENSG00000001626'] # CFTR gene
+sai_paths = [resource_filename('spliceai', os.path.join('models', 'spliceai%d.h5')) % i for i in range(1,6)]
+
+# the five SpliceAI models predict concurrently, so each of them gets a share of the cores
+models.configure_threads(intra_op=max(1, os.cpu_count() // len(sai_paths)))
 
 cis_all = CISpliceAI()
 cis_train = CISpliceAI(os.path.join('src', 'CI-SpliceAI-TRAIN.pb'))
 
+# genes are predicted in tiles of this many positions (plus context), so memory does not grow with gene length
+tile_len = 5000
+
 def pred_from_h5(model_paths, X):
-    models = [keras.models.load_model(path) for path in model_paths]
-    preds = [model.predict(np.array([X]))[0] for model in models]
-    # ensemble average
-    preds = np.mean(preds, axis=0)
+    # models are loaded once per process and their ensemble average is predicted concurrently
+    preds = models.predict_ensemble(model_paths, X, tile_len)
     return np.argmax(preds, axis=1)
 
 def pred_CISpliceAI(model, X):
-    preds = model.predict([X])[0]
+    preds = tiling.predict_tiled(lambda tiles: model.predict(list(tiles)), X, tile_len)
     return np.argmax(preds, axis=1)
 
 # Create ground truth & precictions
@@ -41,7 +44,7 @@ X, Y = ml_data.create_x(gene), ml_data.create_y(gene)
 X = np.concatenate([np.zeros([5000,4]), X, np.zeros([5000,4])])
 
 # predict them
-Y_sai = pred_from_h5([resource_filename('spliceai', os.path.join('models', 'spliceai%d.h5')) % i for i in range(1,6)], X)
+Y_sai = pred_from_h5(sai_paths, X)
 Y_cis_train= pred_CISpliceAI(cis_train, X)
 Y_cis_all= pred_CISpliceAI(cis_all, X)
 
@@ -1,15 +1,17 @@
+import argparse
+import json
 import os
+import sys
 import numpy as np
-import pyfaidx
 
-# one-hot configurations
-OH_X = np.asarray([[0, 0, 0, 0], # N
-                   [1, 0, 0, 0], # A
-                   [0, 1, 0, 0], # C
-                   [0, 0, 1, 0], # G
-                   [0, 0, 0, 1]],# T
-                   dtype=bool)
+sys.path.append(os.path.abspath('.'))
+from src import codec, helpers
+from src.junctions import Junctions, annotation_path
+
+genome_path = os.path.join('third-party', 'hg', 'hg38.fa')
+dataset_path = os.path.join('cache', 'ml_data')
 
+# one-hot configurations
 # OH_Y = {
 #     'neither':  np.asarray([1, 0, 0], dtype=bool),
 #     'acceptor': np.asarray([0, 1, 0], dtype=bool),
@@ -18,35 +20,106 @@ OH_X = np.asarray([[0, 0, 0, 0], # N
 
 def create_x(gene):
     '''Extracts sequence for a gene and encodes it one-hot. Reverse-complements if needed.'''
-    fasta = pyfaidx.Fasta(os.path.join('third-party', 'hg', 'hg38.fa'))
-    # -1 for start because fasta uses 0-index; not -1 for end to include the last nucleotide of the gene
-    seq = fasta[gene.chr][gene.start-1:gene.end].seq
-
-    # to numeric - reverse-complement if needed
-    if gene.strand == '+':
-        num = seq.upper().replace('N', '0').replace('A', '1').replace('C', '2').replace('G', '3').replace('T', '4')
-    else:
-        num = seq.upper().replace('A', '4').replace('C', '3').replace('G', '2').replace('T', '1').replace('N', '0')[::-1]
-
-    num = np.asarray(list(map(int, list(num))))
-    
+    # +1 to include the last nucleotide of the gene
+    codes = helpers.fasta.codes(genome_path, gene.chr, gene.start, gene.end - gene.start + 1)
+
+    # reverse-complement if needed
+    if gene.strand == '-':
+        codes = codec.reverse_complement_codes(codes)
+
     # one-hot encode
-    oh = OH_X[num]
-    return oh
+    return codec.ONE_HOT[codes]
 
 def create_y(gene):
-    '''Creates a one-hot encoded array with annotated ground truth (neither/acceptor/donor). Reverses if needed.'''
-    if gene.strand == '+':
-        donors, acceptors = gene.jn_start, gene.jn_end
-    else:
-        donors, acceptors = gene.jn_end, gene.jn_start
-
-    y = np.array([0] * (gene.end - gene.start + 1)) # +1 to include last nucleotide of gene
-    for site in donors:
-        y[site - gene.start] = 2
-    for site in acceptors:
-        y[site - gene.start] = 1
-    
+    '''Creates a one-hot encoded array with annotated ground truth (neither/acceptor/donor) of a src.junctions.Gene. Reverses if needed.'''
+    y = np.zeros(gene.end - gene.start + 1, dtype=int) # +1 to include last nucleotide of gene
+    y[gene.donors - gene.start] = 2
+    y[gene.acceptors - gene.start] = 1
+
     if gene.strand == '-':
         return y[::-1]
-    return y
\ No newline at end of file
+    return y
+
+
+def build(directory=dataset_path, path=annotation_path):
+    '''
+    Writes X (integer codes, see src/codec.py) and Y (labels of create_y) of every gene of an annotation table into a dataset
+    of two memory-mapped arrays, with genes concatenated and oriented on their strand, and an index of their offsets.
+    Nothing is done if the dataset was built from the same annotation table and genome already.
+    '''
+    index_path = os.path.join(directory, 'index.json')
+    # the genome is too large to hash on every call, so it is identified by its path, size and modification time
+    stat = os.stat(genome_path)
+    key = {'annotation': helpers.file_hash(path), 'genome': [os.path.abspath(genome_path), stat.st_size, stat.st_mtime_ns]}
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            if json.load(f)['key'] == key:
+                return
+
+    os.makedirs(directory, exist_ok=True)
+    junctions = Junctions(path)
+    lengths = junctions.end - junctions.start + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    # write into temporary files first so interrupted builds are redone
+    X = np.lib.format.open_memmap(os.path.join(directory, 'X.tmp.npy'), mode='w+', dtype=np.uint8, shape=(int(offsets[-1]),))
+    Y = np.lib.format.open_memmap(os.path.join(directory, 'Y.tmp.npy'), mode='w+', dtype=np.int8, shape=(int(offsets[-1]),))
+
+    for offset, length, gene in zip(offsets, lengths, junctions.genes()):
+        codes = helpers.fasta.codes(genome_path, gene.chr, gene.start, length)
+        # a gene clipped at a chromosome end would otherwise leave zeros (A) in X
+        assert len(codes) == length, f'{gene.id} exceeds {gene.chr} of {genome_path}'
+        if gene.strand == '-':
+            codes = codec.reverse_complement_codes(codes)
+        X[offset:offset+length] = codes
+        Y[offset:offset+length] = create_y(gene)
+
+    for name, array in [('X', X), ('Y', Y)]:
+        array.flush()
+        os.replace(os.path.join(directory, f'{name}.tmp.npy'), os.path.join(directory, f'{name}.npy'))
+    del X, Y
+
+    # the index is written last, so a dataset without an up-to-date index is rebuilt
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({
+            'key': key,
+            'genes': {gene_id: [int(offset), int(length)] for gene_id, offset, length in zip(junctions.gene_id, offsets, lengths)},
+        }, f)
+    os.replace(index_path + '.tmp', index_path)
+
+
+class Dataset():
+    '''Reader of a dataset written by `build`; arrays of a gene are views into the memory maps'''
+    def __init__(self, directory=dataset_path):
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.genes = json.load(f)['genes']
+        self.X = np.load(os.path.join(directory, 'X.npy'), mmap_mode='r')
+        self.Y = np.load(os.path.join(directory, 'Y.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.genes)
+
+    def _slice(self, gene_id):
+        offset, length = self.genes[gene_id]
+        return slice(offset, offset + length)
+
+    def x(self, gene_id):
+        '''Integer codes of a gene, on its strand'''
+        return self.X[self._slice(gene_id)]
+
+    def y(self, gene_id):
+        '''Labels (neither=0, acceptor=1, donor=2) of a gene, on its strand'''
+        return self.Y[self._slice(gene_id)]
+
+    def one_hot(self, gene_id):
+        '''One-hot encoding of a gene, same as create_x'''
+        return codec.ONE_HOT[self.x(gene_id)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds X and Y of all genes of an annotation table into a memory-mapped dataset.')
+    parser.add_argument('-o', '--output', default=dataset_path)
+    parser.add_argument('-a', '--annotation', default=annotation_path, help='cispliceai annotation table; defaults to grch38')
+    args = parser.parse_args()
+
+    build(args.output, args.annotation)
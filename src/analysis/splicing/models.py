@@ -0,0 +1,35 @@
+'''
+Process-wide registry of loaded models and concurrent execution of model ensembles.
+Each model file is loaded once and reused for every gene; the members of an ensemble predict in parallel threads,
+as TensorFlow releases the GIL while running a graph.
+'''
+import concurrent.futures
+import keras
+import numpy as np
+import tensorflow as tf
+import tiling
+
+_models = {}
+
+def configure_threads(intra_op: int = 0, inter_op: int = 0):
+    '''Limits TensorFlow's thread pools (0 lets TensorFlow decide); has to be called before any model is loaded'''
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+def load_h5(path: str):
+    '''Loads a keras model, once per process'''
+    if path not in _models:
+        _models[path] = keras.models.load_model(path, compile=False)
+    return _models[path]
+
+def predict_ensemble(model_paths: list, X, tile_len=5000, workers=None):
+    '''
+    Averages the tiled predictions (see tiling.predict_tiled) of all models in `model_paths`.
+    Members run in a pool of `workers` threads (one per model by default).
+    '''
+    members = [load_h5(path) for path in model_paths]
+
+    with concurrent.futures.ThreadPoolExecutor(workers or len(members)) as pool:
+        preds = list(pool.map(lambda model: tiling.predict_tiled(lambda tiles: np.asarray(model.predict_on_batch(tiles)), X, tile_len), members))
+
+    return np.mean(preds, axis=0)
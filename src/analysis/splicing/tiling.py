@@ -0,0 +1,25 @@
+import numpy as np
+
+# nucleotides of flanking context SpliceAI-10k and CI-SpliceAI need on either side of a predicted position
+CONTEXT = 10000
+
+def predict_tiled(predict, X, tile_len=5000, batch_size=8, context=CONTEXT):
+    '''
+    Predicts a padded one-hot sequence `X` (including context/2 nucleotides of context on either side) in overlapping tiles.
+    Every tile covers `tile_len` positions plus their context, `predict` is called with batches of up to `batch_size` tiles
+    (array of shape [tiles, tile_len + context, 4]) and must return [tiles, tile_len, classes].
+    Outputs are stitched back together, so memory of the model is bounded by the tile size rather than the sequence length.
+    Since each position only sees its own context, results are the same as predicting X at once.
+    '''
+    n_out = len(X) - context
+    n_tiles = -(-n_out // tile_len)
+
+    # the last tile is padded with N; it only affects positions beyond the sequence, which are cropped
+    X = np.concatenate([X, np.zeros((n_tiles * tile_len - n_out, X.shape[1]), dtype=X.dtype)])
+
+    preds = []
+    for first in range(0, n_tiles, batch_size):
+        tiles = np.stack([X[i*tile_len:(i+1)*tile_len + context] for i in range(first, min(first + batch_size, n_tiles))])
+        preds.extend(predict(tiles))
+
+    return np.concatenate(preds)[:n_out]
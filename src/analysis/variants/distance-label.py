@@ -12,12 +12,21 @@ from src.binning import Binning
 
 bins = Binning()
 
+# count all subsets in one pass
+is_acceptor = bins.df['Closest SS Acceptor']
+counts = bins.bin_subsets(bins.df['Closest SS Offset'], {
+    'donor': ~is_acceptor,
+    'acceptor': is_acceptor,
+    'donor_affecting': ~is_acceptor & bins.df.SpliceAffecting,
+    'acceptor_affecting': is_acceptor & bins.df.SpliceAffecting,
+})
+
 fig, ax = plt.subplots(figsize=(15, 5))
 
 # first draw donor, then acceptor
-donor_counts = bins.draw_bin_counts(ax, bins.closest_is_donor['Closest SS Offset'], 0, 'Closest Site is Donor')
+donor_counts = bins.draw_counts(ax, counts['donor'], 0, 'Closest Site is Donor')
 acceptor_offset = len(donor_counts)
-acceptor_counts = bins.draw_bin_counts(ax, bins.closest_is_acceptor['Closest SS Offset'], acceptor_offset, 'Closest Site is Acceptor')
+acceptor_counts = bins.draw_counts(ax, counts['acceptor'], acceptor_offset, 'Closest Site is Acceptor')
 
 assert sum(donor_counts.values())+sum(acceptor_counts.values()) == len(bins.df), 'Not all data points landed in a bin!'
 
@@ -35,8 +44,8 @@ bins.draw_intron(ax, exon_ends+.5, len(bins.x)-.5, exon_starts-.5, draw_start, d
 bins.draw_exon(ax, exon_starts-.5, len(acceptor_counts)+len(donor_counts)-.5, draw_start, draw_height)
 
 # draw splice affecting bars on top
-donor_counts_affecting = bins.draw_bin_counts(ax, bins.closest_is_donor.loc[bins.closest_is_donor.SpliceAffecting, 'Closest SS Offset'], 0, 'Splice Affecting', color='black', hatch='xxxx', fill=None, lw=None, alpha=.5)
-acceptor_counts_affecting = bins.draw_bin_counts(ax,bins. closest_is_acceptor.loc[bins.closest_is_acceptor.SpliceAffecting, 'Closest SS Offset'], acceptor_offset, color='black', hatch='xxxx', fill=None, lw=None, alpha=.5)
+donor_counts_affecting = bins.draw_counts(ax, counts['donor_affecting'], 0, 'Splice Affecting', color='black', hatch='xxxx', fill=None, lw=None, alpha=.5)
+acceptor_counts_affecting = bins.draw_counts(ax, counts['acceptor_affecting'], acceptor_offset, color='black', hatch='xxxx', fill=None, lw=None, alpha=.5)
 
 # write the number of variants and the number of splice affecting variants on top of every bin
 for x, count_all, count_affecting in zip(bins.x, donor_counts.values(), donor_counts_affecting.values()):
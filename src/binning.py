@@ -1,29 +1,106 @@
 from typing import OrderedDict
+from functools import cached_property
 import pandas as pd
 import os
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
 from pkg_resources import resource_filename
+from src import helpers
+from src.junctions import Junctions
 
-class Binning():
-    def __init__(self):
-        # we are using the splice sites provided by CI-SpliceAI
-        self.annotation_table = pd.read_csv(resource_filename('cispliceai', os.path.join('data', 'grch38.csv'))).set_index('gene_id')
+class SpliceSiteIndex():
+    '''
+        Flat, sorted acceptor and donor coordinates per (chromosome, strand).
+        Answers "closest splice site and signed offset" for whole columns of variants using `np.searchsorted`.
+    '''
+    def __init__(self, junctions: Junctions):
+        self.sites = {}
+
+        # flat sites with the gene they belong to
+        acceptors, acceptor_genes = junctions.flat('acceptor')
+        donors, donor_genes = junctions.flat('donor')
+
+        for chrom, strand in sorted(set(zip(junctions.chr, junctions.strand))):
+            genes = (junctions.chr == chrom) & (junctions.strand == strand)
+
+            # sites shared by several genes only need to be stored once
+            self.sites[(chrom, strand)] = {
+                'acceptor': np.unique(acceptors[genes[acceptor_genes]]).astype(int),
+                'donor': np.unique(donors[genes[donor_genes]]).astype(int),
+            }
+
+    @staticmethod
+    def closest_in(sites: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        '''
+            Returns the offset (position - site) to the closest site in the sorted array `sites` for each closed span [start, end].
+            Spans overlapping a site have offset 0; equidistant sites resolve to the upstream one (positive offset).
+        '''
+        offsets = np.full(len(starts), np.inf)
+        if len(sites) == 0:
+            return offsets
+
+        # first site >= start and first site > end; sites in between lie within the span
+        left = np.searchsorted(sites, starts, side='left')
+        right = np.searchsorted(sites, ends, side='right')
+
+        # closest site before the span is measured from its first position, closest site after from its last
+        before = np.where(left > 0, starts - sites[np.maximum(left - 1, 0)], np.inf)
+        after = np.where(right < len(sites), ends - sites[np.minimum(right, len(sites) - 1)], -np.inf)
 
-        self.acceptors = pd.concat([
-            self.annotation_table.loc[self.annotation_table.strand == '+', 'jn_end'],
-            self.annotation_table.loc[self.annotation_table.strand == '-', 'jn_start']
-        ]).str.split(',').map(lambda lst: np.array(lst, dtype=int))
+        offsets = np.where(before <= -after, before, after)
+        offsets[right > left] = 0
+        return offsets
 
-        self.donors = pd.concat([
-            self.annotation_table.loc[self.annotation_table.strand == '+', 'jn_start'],
-            self.annotation_table.loc[self.annotation_table.strand == '-', 'jn_end']
-        ]).str.split(',').map(lambda lst: np.array(lst, dtype=int))
+    def closest_ss(self, chroms: np.ndarray, strands: np.ndarray, positions: np.ndarray, ref_lens: np.ndarray):
+        '''
+            Returns the distances to the closest splice sites and if they are acceptors, for arrays of variants.
+            +1 means closest SS is 1 downstream (downstream being relative to gene strand).
+            If REF is more than one nucleotide, all positions between POS and POS+len(REF) are considered.
+        '''
+        chroms, strands = np.asarray(chroms), np.asarray(strands)
+        starts = np.asarray(positions, dtype=int)
+        ends = starts + np.asarray(ref_lens, dtype=int) - 1
+
+        closest_acceptor = np.full(len(starts), np.inf)
+        closest_donor = np.full(len(starts), np.inf)
+
+        for (chrom, strand), sites in self.sites.items():
+            subset = (chroms == chrom) & (strands == strand)
+            if not subset.any():
+                continue
+
+            closest_acceptor[subset] = self.closest_in(sites['acceptor'], starts[subset], ends[subset])
+            closest_donor[subset] = self.closest_in(sites['donor'], starts[subset], ends[subset])
+
+        # offsets are relative to the gene strand
+        reverse = strands == '-'
+        closest_acceptor[reverse] *= -1
+        closest_donor[reverse] *= -1
 
-        self.df = pd.read_csv(os.path.join('variants', 'variants.csv')).set_index('ID')
+        closest_is_acceptor = np.abs(closest_acceptor) < np.abs(closest_donor)
+        closest_site = np.where(closest_is_acceptor, closest_acceptor, closest_donor)
+
+        return closest_site, closest_is_acceptor
+
+
+class Binning():
+    annotation_path = resource_filename('cispliceai', os.path.join('data', 'grch38.csv'))
+    variants_path = os.path.join('variants', 'variants.csv')
+    cache_path = os.path.join('cache', 'binning.npz')
+
+    def __init__(self):
+        self.df = pd.read_csv(self.variants_path).set_index('ID')
         self.df.SpliceAffecting = self.df.SpliceAffecting.astype(bool)
 
-        self.df = self.df.apply(self.annotate, axis=1)
+        # annotating is only needed if the splice sites or variants changed since the last run
+        key = helpers.file_hash(self.annotation_path, self.variants_path)
+        annotations = self.load_cache(key)
+        if annotations is None:
+            annotations = self.annotate(self.df)[['Closest SS Offset', 'Closest SS Acceptor']]
+            self.save_cache(key, annotations)
+
+        self.df = self.df.join(annotations)
 
         # split into acceptors and donors
         self.closest_is_acceptor = self.df[self.df['Closest SS Acceptor']]
@@ -51,42 +128,54 @@ class Binning():
         # map bins to offset on the diagram
         self.x = np.arange(len(bins), dtype=int)
 
-    def closest_ss_for_subset(self, var_pos: int, ref_len:int, sites: pd.Series):
-        '''Returns the difference to the closest splice site in this subset of sites'''
-        # if REF is more than one nucleotide, we check all positions between POS and POS+len(REF); this is not very efficient but simple enough
-        closest_offset = np.inf
+    @cached_property
+    def junctions(self):
+        # we are using the splice sites provided by CI-SpliceAI
+        return Junctions(self.annotation_path)
 
-        for pos in range(var_pos, var_pos+ref_len):
-            closest_per_gene = sites.map(lambda s: (pos - s)[np.argmin(np.abs(s-pos))])
-            closest = closest_per_gene.iloc[np.argmin(closest_per_gene.abs())]
-            if abs(closest) < abs(closest_offset):
-                closest_offset = closest
-        
-        return closest_offset
+    @cached_property
+    def index(self):
+        return SpliceSiteIndex(self.junctions)
 
-    def closest_ss(self, pos: int, chrom:str, strand:str, ref_len: int):
-        '''
-            Returns the distance to the closest splice site and if it's an acceptor.
-            +1 means closest SS is 1 downstream (downstream being relative to gene strand)
-        '''
-        # only look at genes on the correct chromosome and strand
-        genes = self.annotation_table[
-            (self.annotation_table.chr == chrom) &
-            (self.annotation_table.strand == strand)
-        ]
+    def load_cache(self, key: str):
+        '''Returns cached annotations if they were computed from the same inputs, otherwise None'''
+        if not os.path.isfile(self.cache_path):
+            return None
 
-        closest_acceptor, closest_donor = self.closest_ss_for_subset(pos, ref_len, self.acceptors.loc[genes.index]), self.closest_ss_for_subset(pos, ref_len, self.donors.loc[genes.index])
-        if strand == '-':
-            closest_acceptor, closest_donor = -closest_acceptor, -closest_donor
+        with np.load(self.cache_path) as cache:
+            if str(cache['key']) != key:
+                return None
 
-        closest_is_acceptor = abs(closest_acceptor) < abs(closest_donor)
-        closest_site = closest_acceptor if closest_is_acceptor else closest_donor
+            return pd.DataFrame({
+                'Closest SS Offset': cache['offset'],
+                'Closest SS Acceptor': cache['acceptor'],
+            }, index=pd.Index(cache['id'], name='ID'))
 
-        return closest_site, closest_is_acceptor
+    def save_cache(self, key: str, annotations: pd.DataFrame):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
 
-    def annotate(self, row):
-        row['Closest SS Offset'], row['Closest SS Acceptor'] = self.closest_ss(row.POS, 'chr'+row['#CHROM'], row.strand, len(row.REF))
-        return row
+        # write to a temporary file of this process first so concurrent scripts never read a partial cache or replace each other's
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(self.cache_path), suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            np.savez(
+                f,
+                key=np.array(key),
+                id=np.asarray(annotations.index, dtype=str),
+                offset=annotations['Closest SS Offset'].values.astype(float),
+                acceptor=annotations['Closest SS Acceptor'].values.astype(bool),
+            )
+        os.replace(tmp_path, self.cache_path)
+
+    def annotate(self, df: pd.DataFrame):
+        '''Annotates the closest splice site offset and type for every variant'''
+        df = df.copy()
+        df['Closest SS Offset'], df['Closest SS Acceptor'] = self.index.closest_ss(
+            ('chr' + df['#CHROM'].astype(str)).values,
+            df.strand.values,
+            df.POS.values,
+            df.REF.str.len().values
+        )
+        return df
 
     def signed(self, number: int):
         if number == 0:
@@ -107,14 +196,44 @@ class Binning():
         return label
 
     def bin(self, series, bins):
-        counts = OrderedDict()
-        for b in bins:
-            data = series[(series >= b[0]) & (series <= b[1])]
-            # if data.empty:
-            #     continue
+        return self.bin_subsets(series, {None: np.ones(len(series), dtype=bool)}, bins)[None]
 
-            counts[b] = len(data)
-        return counts
+    def bin_indices(self, series, bins=None):
+        '''Assigns every value in `series` the index of its bin in one `np.searchsorted` pass; -1 if it falls into no bin'''
+        bins = self.bins if bins is None else bins
+        lower = np.array([b[0] for b in bins], dtype=float)
+        upper = np.array([b[1] for b in bins], dtype=float)
+        values = np.asarray(series, dtype=float)
+
+        # bins are sorted by their lower edge and do not overlap, so only the upper edge needs checking
+        indices = np.searchsorted(lower, values, side='right') - 1
+        in_bin = indices >= 0
+        in_bin[in_bin] = values[in_bin] <= upper[indices[in_bin]]
+        indices[~in_bin] = -1
+
+        return indices
+
+    def bin_subsets(self, series, subsets: dict, bins=None):
+        '''
+            Counts `series` per bin for any number of (possibly overlapping) label subsets with one grouped `np.bincount`.
+            `subsets` maps a name to a boolean mask aligned with `series`.
+            Returns a dict mapping each name to an OrderedDict of bin -> count.
+        '''
+        bins = self.bins if bins is None else bins
+        indices = self.bin_indices(series, bins)
+
+        masks = np.array([np.asarray(mask, dtype=bool) for mask in subsets.values()], dtype=bool).reshape(len(subsets), len(indices))
+        subset_ids, members = np.nonzero(masks & (indices >= 0))
+
+        counts = np.bincount(
+            subset_ids * len(bins) + indices[members],
+            minlength=len(subsets) * len(bins)
+        ).reshape(len(subsets), len(bins))
+
+        return {
+            name: OrderedDict(zip(bins, subset_counts.tolist()))
+            for name, subset_counts in zip(subsets.keys(), counts)
+        }
 
 
     def draw_intron(self, ax: plt.Axes, start, sep_pos, stop, draw_y_start, draw_height, sep_offset=.1, sep_len=.1):
@@ -140,9 +259,11 @@ class Binning():
 
     # draw bin counts
     def draw_bin_counts(self, ax, series, offset, label=None, **barargs):
-        counts = self.bin(series, self.bins)
-        # x, y = np.array(list(range(offset, offset+len(counts)))), np.array(list(counts.values()))
+        return self.draw_counts(ax, self.bin(series, self.bins), offset, label, **barargs)
+
+    def draw_counts(self, ax, counts, offset, label=None, **barargs):
+        '''Draws counts previously computed by `bin` or `bin_subsets`'''
         x = self.x + offset
         y = np.array(list(counts.values()))
         ax.bar(x, y, label=label, **barargs)
-        return counts
\ No newline at end of file
+        return counts
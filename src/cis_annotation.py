@@ -0,0 +1,166 @@
+'''
+Gene-batched CI-SpliceAI inference.
+cispliceai's Annotator predicts a reference and an alternative window for every variant and overlapping gene,
+although nearby variants of the same gene share almost all of their 10 kb+ reference context.
+`RegionAnnotator` merges the windows of nearby variants in the same gene into regions, predicts the reference of each region once
+and slices the reference predictions of every variant from it; alternative sequences are batched into large tensors.
+As CI-SpliceAI only sees CONTEXT_LEN/2 nucleotides on either side of a position, annotations are the same as the Annotator's.
+This overrides private parts of the Annotator (_run_batches, _model, preprocessor, annotation_cache) as of cispliceai 1.2.2,
+which setup.sh pins; check the output against the Annotator's before upgrading.
+'''
+import collections
+from typing import List
+import numpy as np
+from cispliceai import const, progress
+from cispliceai.annotation import AnnotationJob, Annotator, VariantEffect
+from cispliceai.data import AreaWithML
+from cispliceai.fasta import BaseFasta, PyFaidXFasta
+from src import codec
+
+
+class RegionAnnotator(Annotator):
+    '''
+        Drop-in for cispliceai's Annotator that shares reference predictions between variants of the same gene and locus.
+        Windows closer than CONTEXT_LEN are merged into regions of up to `max_region_len` nucleotides;
+        jobs are sorted by locus and processed `jobs_per_chunk` at a time to bound memory.
+    '''
+    def __init__(self, batch_size_mb: float = 16.0, max_region_len: int = 100_000, jobs_per_chunk: int = 1000, fasta: BaseFasta = None, **kwargs):
+        fasta = PyFaidXFasta() if fasta is None else fasta
+        super().__init__(batch_size_mb=batch_size_mb, fasta=fasta, **kwargs)
+        self.fasta = fasta
+        self.max_region_len = max_region_len
+        self.jobs_per_chunk = jobs_per_chunk
+
+    def _run_batches(self, jobs: List[AnnotationJob]):
+        jobs = sorted(jobs, key=lambda job: (job.variant.reference_path, job.variant.chrom, job.variant.pos))
+        prog = progress.ProgressOutput(len(jobs))
+
+        for start in range(0, len(jobs), self.jobs_per_chunk):
+            self._run_chunk(jobs[start:start+self.jobs_per_chunk])
+            prog.update(min(start + self.jobs_per_chunk, len(jobs)))
+
+    def _run_chunk(self, jobs: List[AnnotationJob]):
+        prepared = []
+        for job in jobs:
+            try:
+                prepared.append((job, self.preprocessor.get_ml_data(job.variant)))
+            except AssertionError as e:
+                # pre-processing error (i.e. mismatching REF annotation)
+                self.annotation_cache.set_error(job.variant, str(e))
+
+        areas = [area for _, ml_data in prepared for area in ml_data]
+
+        # model inputs of all regions, the strand they are predicted on, and (area, offset within the region) of their windows
+        regions = list(self._create_regions(areas))
+
+        preds_ref = [None] * len(areas)
+        for (x, strand, members), preds in zip(regions, self._predict([x for x, _, _ in regions])):
+            if strand == '-':
+                preds = preds[::-1]
+
+            for i, offset in members:
+                preds_ref[i] = preds[offset:offset + len(areas[i].x_ref) - const.CONTEXT_LEN]
+
+        preds_var = self._predict([area.x_var for area in areas])
+
+        i = 0
+        for job, ml_data in prepared:
+            annotations_masked = []
+            annotations_unmasked = []
+            for area in ml_data:
+                pred_ref, pred_var = preds_ref[i], preds_var[i]
+
+                if area.strand == '-':
+                    pred_var = pred_var[::-1]
+
+                effect = VariantEffect(area, pred_ref, pred_var, job.variant.max_dist_from_var)
+                annotations_masked.append(effect.get_annotation(True))
+                annotations_unmasked.append(effect.get_annotation(False))
+                i += 1
+
+            self.annotation_cache.set_annotations(job.variant, False, annotations_unmasked)
+            self.annotation_cache.set_annotations(job.variant, True, annotations_masked)
+
+    @staticmethod
+    def _window(area: AreaWithML):
+        '''1-based [start, end) of the reference nucleotides the model sees for an area of a variant'''
+        start = area.var_spec.pos - area.var_spec.max_dist_from_var - const.CONTEXT_LEN//2
+        return start, start + len(area.x_ref)
+
+    @staticmethod
+    def _region_key(area: AreaWithML):
+        '''Areas of equal keys see the same reference at the same position; None if an area cannot share its reference'''
+        var_spec = area.var_spec
+        start, end = RegionAnnotator._window(area)
+        expected_len = 2*(var_spec.max_dist_from_var + const.CONTEXT_LEN//2) + len(var_spec.ref)
+        if start < 1 or end - start != expected_len + expected_len % 2:
+            # cispliceai pads and masks windows clipped at either end of the chromosome differently
+            return None
+
+        # areas are masked to [start, end); intergenic ones are specific to their variant and hence only share with identical windows
+        bounds = None if var_spec.keep_nucs_outside_gene else (area.start, area.end)
+        return var_spec.reference_path, var_spec.chrom, area.strand, bounds
+
+    def _create_regions(self, areas: List[AreaWithML]):
+        '''Yields (model input, strand, [(area index, offset of its window)]) of merged regions'''
+        windows = collections.defaultdict(list)
+        for i, area in enumerate(areas):
+            key = self._region_key(area)
+            if key is None:
+                yield area.x_ref, area.strand, [(i, 0)]
+            else:
+                windows[key].append(i)
+
+        for key, members in windows.items():
+            members.sort(key=lambda i: self._window(areas[i]))
+
+            # windows open a new region if they start CONTEXT_LEN after the previous end, or the region would grow too long
+            merged = []
+            for i in members:
+                start, end = self._window(areas[i])
+                if merged and start < merged[-1][1] + const.CONTEXT_LEN and max(end, merged[-1][1]) - merged[-1][0] <= self.max_region_len:
+                    merged[-1][1] = max(end, merged[-1][1])
+                    merged[-1][2].append(i)
+                else:
+                    merged.append([start, end, [i]])
+
+            for start, end, region_members in merged:
+                x = self._region_x(key, start, end)
+                if x is None:
+                    for i in region_members:
+                        yield areas[i].x_ref, areas[i].strand, [(i, 0)]
+                else:
+                    yield x, key[2], [(i, self._window(areas[i])[0] - start) for i in region_members]
+
+    def _region_x(self, key: tuple, start: int, end: int):
+        '''One-hot reference of [start, end), masked to the gene and oriented on its strand; None if clipped at the chromosome end'''
+        reference_path, chrom, strand, bounds = key
+        seq = self.fasta.extract(reference_path, chrom, start, end - start)
+        if len(seq) != end - start:
+            return None
+
+        x = codec.one_hot(seq)
+        if bounds is not None:
+            x[:max(bounds[0] - start, 0)] = 0
+            x[max(bounds[1] - start, 0):] = 0
+
+        if strand == '-':
+            x = np.flip(x, axis=1)[::-1]
+        return x
+
+    def _predict(self, xs: list):
+        '''Predicts all inputs in batches of at most `batch_size_mb` (padded to the longest input); returns predictions in input order'''
+        order = sorted(range(len(xs)), key=lambda i: -len(xs[i]))
+        preds = [None] * len(xs)
+
+        batch = []
+        for i in order + [None]:
+            # inputs are sorted by length, so the first one of a batch is the longest
+            if batch and (i is None or (len(batch) + 1) * len(xs[batch[0]]) * 4 * 4 / 1000000 > self.batch_size_mb):
+                for j, pred in zip(batch, self._model.predict([xs[j] for j in batch])):
+                    preds[j] = pred
+                batch = []
+            if i is not None:
+                batch.append(i)
+
+        return preds
@@ -0,0 +1,45 @@
+'''
+Shared nucleotide codecs.
+Strings are complemented through translation tables, and encoded into integer codes or one-hot arrays through lookup tables,
+so no Python object is created per nucleotide.
+'''
+import string
+import numpy as np
+
+# nucleotide -> integer code (A=0, C=1, G=2, T=3, N/other=4)
+ENCODING = np.full(256, 4, dtype=np.uint8)
+for code, nucs in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for nuc in nucs:
+        ENCODING[ord(nuc)] = code
+
+# integer code -> upper-case nucleotide
+LETTERS = np.frombuffer(b'ACGTN', dtype=np.uint8)
+
+# integer code -> one-hot encoding (A, C, G, T; N/other is all zeros)
+ONE_HOT = np.concatenate([np.eye(4, dtype=bool), np.zeros((1, 4), dtype=bool)])
+
+# upper-cases and complements in a single pass; letters other than ACGT are only upper-cased
+COMPLEMENT = str.maketrans(string.ascii_letters, string.ascii_letters.upper().translate(str.maketrans('ACGT', 'TGCA')))
+
+
+def encode(seq):
+    '''Encodes a str or bytes sequence into integer codes'''
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    return ENCODING[np.frombuffer(seq, dtype=np.uint8)]
+
+def decode(codes: np.ndarray):
+    '''Decodes integer codes into an upper-case string; N/other becomes N'''
+    return LETTERS[codes].tobytes().decode('ascii')
+
+def one_hot(seq):
+    '''One-hot encodes a sequence or integer codes'''
+    return ONE_HOT[seq if isinstance(seq, np.ndarray) else encode(seq)]
+
+def reverse_complement(seq: str):
+    '''Upper-case reverse complement of a string'''
+    return seq.translate(COMPLEMENT)[::-1]
+
+def reverse_complement_codes(codes: np.ndarray):
+    '''Reverse complement of integer codes; N/other stays N/other'''
+    return np.where(codes > 3, codes, 3 - codes)[::-1]
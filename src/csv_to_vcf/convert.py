@@ -1,13 +1,21 @@
+# this script is executed by main.sh. cwd is expected to be project root
+import argparse
 import pandas as pd
 import sys
 import os
 import numpy as np
 
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-import helpers
+sys.path.append(os.path.abspath('.'))
+from src import helpers
 
-df = pd.read_csv(os.path.join('..', 'variants', 'variants.csv')).set_index('ID')
-genome_path = sys.argv[1]
+parser = argparse.ArgumentParser(description='Checks the REF annotations of the variants against the genome and writes them as an unsorted, unnormalised VCF.')
+parser.add_argument('genome')
+parser.add_argument('-i', '--input', default=os.path.join('variants', 'variants.csv'))
+parser.add_argument('-o', '--output', default='plain.vcf')
+args = parser.parse_args()
+
+df = pd.read_csv(args.input).set_index('ID')
+genome_path = args.genome
 
 # -- CHECK DATA --
 
@@ -29,7 +37,7 @@ if sum(mismatched) != 0:
 
 
 # Append 'chr'
-df['#CHROM'] = 'chr'+df['#CHROM']
+df['#CHROM'] = 'chr'+df['#CHROM'].astype(str)
 
 # Add missing cols
 df['FILTER'] = '.'
@@ -38,7 +46,7 @@ df['INFO'] = '.'
 # Export in vcf format
 csv = df.reset_index().filter(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'FILTER', 'INFO']).to_csv(index=False, sep='\t', header=True)
 
-with open('plain.vcf', 'w') as f:
+with open(args.output, 'w') as f:
     f.writelines('''##fileformat=VCFv4.2
 ##reference=GRCh38\n''')
     f.write(csv)
\ No newline at end of file
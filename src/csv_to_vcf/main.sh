@@ -1,43 +1,35 @@
 #!/bin/bash
-source ../helpers.sh
+source src/helpers.sh
 
-# this script generates the variants.vcf and variants_mmsplice.vcf in the main directory.
-# you don't need to run it as the variants.vcf is checked into git.
-# if you want to run it, cd into this directory first.
+# this script generates variants/variants.vcf and variants/variants_mmsplice.vcf. cwd is expected to be project root
+# you don't need to run it as both are checked into git; src/predict/run.py runs it as the first stage of predict.sh,
+# so predictions are redone if variants.csv or the conversion changes.
 
 # it parses the variants.csv file into a vcf file. it also normalises (rows and align-left) it for MMSplice, as suggested in the MMSplice pipeline.
 
-HG=../third-party/hg/hg38.fa
+HG=third-party/hg/hg38.fa
+
+# intermediate files go into a temporary directory
+TMP=$(mktemp -d)
+trap "rm -rf $TMP" EXIT
 
 # sanity check and conversion to tab-delimited format (plain.vcf)
-python convert.py $HG
+python src/csv_to_vcf/convert.py $HG -o $TMP/plain.vcf
 
 # Index VCF
-bgzip -c plain.vcf > plain.vcf.gz
-rm plain.vcf
-tabix -fp vcf plain.vcf.gz
+bgzip -c $TMP/plain.vcf > $TMP/plain.vcf.gz
+tabix -fp vcf $TMP/plain.vcf.gz
 
 # normalise rows, this writes headers as well
-bcftools norm -m-both -o norm1.vcf.gz plain.vcf.gz
+bcftools norm -m-both -O v -o $TMP/norm1.vcf $TMP/plain.vcf.gz
 
-# move variants into main folder; this is our main file
-gzip -d norm1.vcf.gz
-cp norm1.vcf ../variants.vcf
+# this is our main file
+cp $TMP/norm1.vcf variants/variants.vcf
 
 # the rest is only needed for MMSplice, see https://github.com/kipoi/models/tree/master/MMSplice
-bgzip -c norm1.vcf > norm1.vcf.gz
+bgzip -c $TMP/norm1.vcf > $TMP/norm1.vcf.gz
 
 # normalise left
-bcftools norm -f $HG -o norm2.vcf.gz norm1.vcf.gz
-
-# and unzip it again
-gzip -d norm2.vcf.gz
-
-# move into main folder
-mv norm2.vcf ../variants_mmsplice.vcf
+bcftools norm -f $HG -O v -o $TMP/norm2.vcf $TMP/norm1.vcf.gz
 
-# clean up
-rm norm1.vcf
-rm norm1.vcf.gz
-rm plain.vcf.gz
-rm plain.vcf.gz.tbi
\ No newline at end of file
+cp $TMP/norm2.vcf variants/variants_mmsplice.vcf
@@ -0,0 +1,151 @@
+'''
+2-bit packed, memory-mapped genome store.
+A FASTA file is converted once (see src/setup/pack_genome.py) into a directory next to it, holding per sequence
+four nucleotides per byte plus the runs of N (and any other non-ACGT letter), which are stored as N.
+Slices are read from memory maps without parsing any text, so processes on one node share about a quarter of the page cache a text FASTA would need.
+'''
+import json
+import os
+import cispliceai.fasta
+import numpy as np
+import pyfaidx
+from src.codec import LETTERS, ONE_HOT, encode
+
+# bit offsets of the four nucleotides within a byte, first nucleotide in the highest bits
+SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+INDEX_FILE = 'index.json'
+
+
+def store_path(genome_path: str):
+    '''Directory of the packed store belonging to a FASTA file'''
+    return genome_path + '.2bit'
+
+def pack(codes: np.ndarray):
+    '''Packs integer codes four per byte; returns the packed bytes and the [start, end) runs of invalid codes'''
+    invalid = codes > 3
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = np.where(invalid, 0, codes)
+    packed = (padded.reshape(-1, 4) << SHIFTS).sum(axis=1, dtype=np.uint8)
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], invalid.view(np.int8), [0]])))
+    return packed, edges.reshape(-1, 2).astype(np.int64)
+
+def convert(genome_path: str, chroms: list = None, directory: str = None):
+    '''Writes the packed store of `genome_path` (all sequences by default); sequences already converted are skipped'''
+    directory = directory or store_path(genome_path)
+    os.makedirs(directory, exist_ok=True)
+
+    index_path = os.path.join(directory, INDEX_FILE)
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    fasta = pyfaidx.Fasta(genome_path)
+    for chrom in chroms or list(fasta.keys()):
+        if chrom in index:
+            continue
+
+        codes = encode(fasta[chrom][:].seq)
+        packed, n_runs = pack(codes)
+        np.save(os.path.join(directory, f'{chrom}.npy'), packed)
+        np.save(os.path.join(directory, f'{chrom}.n.npy'), n_runs)
+
+        # the index is written last, so interrupted conversions are redone
+        index[chrom] = len(codes)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+        yield chrom
+
+
+class PackedGenome():
+    '''Reader of a store written by `convert`. Coordinates are 0-based and half-open, slices are clipped to the sequence.'''
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.lengths = json.load(f)
+        self._packed = {}
+        self._n_runs = {}
+
+    def __contains__(self, chrom: str):
+        return chrom in self.lengths
+
+    def _load(self, chrom: str):
+        if chrom not in self._packed:
+            self._packed[chrom] = np.load(os.path.join(self.directory, f'{chrom}.npy'), mmap_mode='r')
+            self._n_runs[chrom] = np.load(os.path.join(self.directory, f'{chrom}.n.npy'))
+        return self._packed[chrom], self._n_runs[chrom]
+
+    def codes(self, chrom: str, start: int, end: int):
+        '''Integer codes (A=0, C=1, G=2, T=3, N=4) of [start, end)'''
+        packed, n_runs = self._load(chrom)
+        start = min(max(start, 0), self.lengths[chrom])
+        end = min(max(end, start), self.lengths[chrom])
+
+        codes = (packed[start // 4:-(-end // 4)][:, None] >> SHIFTS & 3).ravel()
+        codes = codes[start % 4:start % 4 + end - start]
+
+        # runs are sorted and disjoint, so the overlapping ones are contiguous
+        for run_start, run_end in n_runs[np.searchsorted(n_runs[:, 1], start, side='right'):np.searchsorted(n_runs[:, 0], end)]:
+            codes[max(run_start - start, 0):run_end - start] = 4
+        return codes
+
+    def bytes(self, chrom: str, start: int, end: int):
+        '''Upper-case ASCII nucleotides of [start, end)'''
+        return LETTERS[self.codes(chrom, start, end)].tobytes()
+
+    def one_hot(self, chrom: str, start: int, end: int):
+        '''One-hot encoding (A, C, G, T; N is all zeros) of [start, end)'''
+        return ONE_HOT[self.codes(chrom, start, end)]
+
+
+class PackedFasta(cispliceai.fasta.BaseFasta):
+    '''
+        Drop-in for cispliceai's PyFaidXFasta reading from the packed store of a FASTA file.
+        Falls back to the FASTA file itself if it has not been converted.
+        Reading from a store differs from pyfaidx in two cases:
+        - IUPAC ambiguity codes (R, Y, ...) are returned as N, as the store only keeps runs of N. `codes` is unaffected, as those encode to N anyway.
+        - Ranges starting before the contig are clipped at its start, so fewer than `len` nucleotides are returned;
+          pyfaidx counts negative starts from the contig end instead, which usually yields an empty sequence. Past the contig end both return fewer nucleotides.
+    '''
+    def __init__(self):
+        self._stores = {}
+        self._fallback = None
+
+    def store(self, reference_path: str):
+        '''Returns the packed store of `reference_path`, or None if there is none'''
+        if reference_path not in self._stores:
+            directory = store_path(reference_path)
+            self._stores[reference_path] = PackedGenome(directory) if os.path.isfile(os.path.join(directory, INDEX_FILE)) else None
+        return self._stores[reference_path]
+
+    def codes(self, reference_path: str, contig: str, pos: int, len: int):
+        '''Integer codes of `len` nucleotides from 1-based `pos`'''
+        store = self.store(reference_path)
+        if store is None:
+            return encode(self.extract(reference_path, contig, pos, len))
+        return store.codes(self._contig(store, contig), pos - 1, pos - 1 + len)
+
+    def one_hot(self, reference_path: str, contig: str, pos: int, len: int):
+        return ONE_HOT[self.codes(reference_path, contig, pos, len)]
+
+    def extract(self, reference_path: str, contig: str, pos: int, len: int):
+        store = self.store(reference_path)
+        if store is None:
+            if self._fallback is None:
+                self._fallback = cispliceai.fasta.PyFaidXFasta()
+            return self._fallback.extract(reference_path, contig, pos, len)
+        return store.bytes(self._contig(store, contig), pos - 1, pos - 1 + len).decode('ascii')
+
+    @staticmethod
+    def _contig(store: PackedGenome, contig: str):
+        # accept contigs with or without chr prefix, like PyFaidXFasta
+        contig = str(contig)
+        if contig in store:
+            return contig
+        alternative = contig[3:] if contig.startswith('chr') else 'chr' + contig
+        if alternative in store:
+            return alternative
+        raise KeyError(f'Contig {contig} not found in {store.directory}')
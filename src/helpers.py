@@ -1,12 +1,62 @@
-import cispliceai.fasta
+import hashlib
 import pysam
 import numpy as np
 import pandas as pd
+from src import codec, genome
 
-fasta = cispliceai.fasta.PyFaidXFasta()
+# reads from the 2-bit store of a genome if src/setup/pack_genome.py created one, otherwise from the FASTA file
+fasta = genome.PackedFasta()
 
 def extract_sequences(genome_path, chromosomes, starts, ends, context=0):
-   return [extract_sequence(genome_path, chrom, start, end, context=context) for chrom, start, end in zip(chromosomes, starts, ends)]
+   '''
+   Extracts [start, end) (1-based) for arrays of intervals; returns sequences in input order.
+   Intervals are sorted by chromosome and position, and overlapping or adjacent intervals are merged into a single read.
+   '''
+   chromosomes = np.asarray(chromosomes).astype(str)
+   starts = np.asarray(starts, dtype=int) - context
+   ends = np.asarray(ends, dtype=int) + context
+
+   if context:
+      # ensure that the reference length is dividable by 2 or delta position will be half R
+      ends[(ends - starts)%2 != 0] +=1
+
+   seqs = [None] * len(starts)
+
+   for chrom in np.unique(chromosomes):
+      members = np.flatnonzero(chromosomes == chrom)
+      members = members[np.argsort(starts[members], kind='stable')]
+      chrom_starts, chrom_ends = starts[members], ends[members]
+
+      # an interval opens a new read if it starts after all previous intervals ended
+      reach = np.maximum.accumulate(chrom_ends)
+      read_bounds = np.flatnonzero(np.concatenate([[True], chrom_starts[1:] > reach[:-1]]))
+      read_ends = np.maximum.reduceat(chrom_ends, read_bounds)
+      read_bounds = np.append(read_bounds, len(members))
+
+      for read_first, read_last, read_end in zip(read_bounds[:-1], read_bounds[1:], read_ends):
+         read_start = chrom_starts[read_first]
+         seq = fasta.extract(genome_path, chrom, read_start, read_end - read_start)
+         for i in range(read_first, read_last):
+            seqs[members[i]] = seq[chrom_starts[i] - read_start:chrom_ends[i] - read_start]
+
+   return seqs
+
+def encode_sequences(seqs, one_hot=False):
+   '''
+   Encodes sequences into integer codes (see codec.ENCODING) or one-hot arrays.
+   Returns one stacked array if all sequences have the same length, otherwise a list of arrays.
+   '''
+   encoded = [codec.encode(seq) for seq in seqs]
+   if one_hot:
+      encoded = [codec.ONE_HOT[codes] for codes in encoded]
+
+   if len(set(map(len, encoded))) == 1:
+      return np.stack(encoded)
+   return encoded
+
+def extract_encoded(genome_path, chromosomes, starts, ends, context=0, one_hot=False):
+   '''Like `extract_sequences`, but returns integer codes or one-hot arrays (see `encode_sequences`)'''
+   return encode_sequences(extract_sequences(genome_path, chromosomes, starts, ends, context=context), one_hot=one_hot)
 
 def extract_sequence(genome_path, chrom, start, end, context=0):
    start -= context
@@ -18,8 +68,14 @@ def extract_sequence(genome_path, chrom, start, end, context=0):
      
    return fasta.extract(genome_path, chrom, start, end-start)
 
-def reverse_complement(seq: str):
-   return seq.upper().replace('A', 't').replace('C', 'g').replace('G', 'c').replace('T', 'a').upper()[::-1]
+def file_hash(*paths):
+   '''Returns a sha256 hex digest over the contents of all files in `paths`'''
+   digest = hashlib.sha256()
+   for path in paths:
+      with open(path, 'rb') as f:
+         for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+   return digest.hexdigest()
 
 
 def vcf_to_df(file):
@@ -0,0 +1,135 @@
+'''
+CSR-style splice sites of a cispliceai annotation table.
+The comma-separated jn_start/jn_end strings are parsed once into flat int32 arrays of acceptor and donor coordinates
+(according to each gene's strand) plus per-gene offsets, and cached as .npz;
+later runs load the arrays without parsing anything or creating objects per gene.
+'''
+import os
+import tempfile
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_filename
+from src import helpers
+
+annotation_path = resource_filename('cispliceai', os.path.join('data', 'grch38.csv'))
+cache_dir = 'cache'
+
+GENE_COLUMNS = ['gene_id', 'chr', 'strand', 'start', 'end']
+
+
+class Gene(NamedTuple):
+    '''Gene of a `Junctions` table; acceptors and donors are views into its flat arrays'''
+    id: str
+    chr: str
+    strand: str
+    start: int
+    end: int
+    acceptors: np.ndarray
+    donors: np.ndarray
+
+
+def flatten(junctions: pd.Series):
+    '''Parses a column of comma-separated junction strings into one flat int32 array and per-row offsets into it'''
+    counts = junctions.str.count(',').to_numpy() + 1
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return np.array(','.join(junctions).split(','), dtype=np.int32), offsets
+
+def parse(path: str):
+    '''Converts an annotation table into the arrays of `Junctions`'''
+    table = pd.read_csv(path)
+    reverse = (table.strand == '-').to_numpy()
+
+    jn_start, jn_start_offsets = flatten(table.jn_start)
+    jn_end, jn_end_offsets = flatten(table.jn_end)
+
+    arrays = {col: table[col].to_numpy(dtype=str if col in ['gene_id', 'chr', 'strand'] else np.int64) for col in GENE_COLUMNS}
+
+    # acceptors are junction ends on the forward strand and starts on the reverse strand, donors vice versa
+    for kind, (forward, forward_offsets), (reverse_sites, reverse_offsets) in [
+        ('acceptor', (jn_end, jn_end_offsets), (jn_start, jn_start_offsets)),
+        ('donor', (jn_start, jn_start_offsets), (jn_end, jn_end_offsets)),
+    ]:
+        # gather every gene's slice from both arrays concatenated
+        sources = np.concatenate([forward, reverse_sites])
+        starts = np.where(reverse, reverse_offsets[:-1] + len(forward), forward_offsets[:-1])
+        counts = np.where(reverse, np.diff(reverse_offsets), np.diff(forward_offsets))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        arrays[f'{kind}s'] = sources[np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])]
+        arrays[f'{kind}_offsets'] = offsets
+
+    return arrays
+
+
+class Junctions():
+    '''
+        Genes of an annotation table with their acceptors and donors in CSR layout:
+        the sites of the i-th gene are `acceptors[acceptor_offsets[i]:acceptor_offsets[i+1]]` (donors alike).
+        Built from `path` on first use and cached in `directory`; the cache is rebuilt if the table changes.
+    '''
+    def __init__(self, path: str = annotation_path, directory: str = cache_dir):
+        cache_path = os.path.join(directory, 'junctions', os.path.basename(path) + '.npz')
+        key = helpers.file_hash(path)
+
+        arrays = self.load_cache(cache_path, key)
+        if arrays is None:
+            arrays = parse(path)
+            self.save_cache(cache_path, key, arrays)
+
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self._positions = None
+
+    @staticmethod
+    def load_cache(cache_path: str, key: str):
+        '''Returns the cached arrays if they were built from the same table, otherwise None'''
+        if not os.path.isfile(cache_path):
+            return None
+
+        with np.load(cache_path) as cache:
+            if str(cache['key']) != key:
+                return None
+            return {name: cache[name] for name in cache.files if name != 'key'}
+
+    @staticmethod
+    def save_cache(cache_path: str, key: str, arrays: dict):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # write to a temporary file of this process first so concurrent scripts never read a partial cache or replace each other's
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            np.savez(f, key=np.array(key), **arrays)
+        os.replace(tmp_path, cache_path)
+
+    def __len__(self):
+        return len(self.gene_id)
+
+    def position(self, gene_id: str):
+        '''Row of a gene'''
+        if self._positions is None:
+            self._positions = {gene_id: i for i, gene_id in enumerate(self.gene_id)}
+        return self._positions[gene_id]
+
+    def sites(self, kind: str, i: int):
+        '''Acceptors or donors (`kind`) of the i-th gene'''
+        offsets = getattr(self, f'{kind}_offsets')
+        return getattr(self, f'{kind}s')[offsets[i]:offsets[i+1]]
+
+    def gene(self, i):
+        '''Gene by row or gene id'''
+        if isinstance(i, str):
+            i = self.position(i)
+        return Gene(
+            str(self.gene_id[i]), str(self.chr[i]), str(self.strand[i]), int(self.start[i]), int(self.end[i]),
+            self.sites('acceptor', i), self.sites('donor', i),
+        )
+
+    def genes(self):
+        for i in range(len(self)):
+            yield self.gene(i)
+
+    def flat(self, kind: str):
+        '''All acceptors or donors (`kind`) with the row of their gene'''
+        offsets = getattr(self, f'{kind}_offsets')
+        return getattr(self, f'{kind}s'), np.repeat(np.arange(len(self)), np.diff(offsets))
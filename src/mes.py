@@ -0,0 +1,177 @@
+'''
+Vectorised MaxEntScan scoring.
+Scores all 9-mer (donor) or 23-mer (acceptor) windows of a sequence in one batch, using the matrices loaded by maxentpy.
+Gives the same results as `maxent.score5` and `maxent.score3`; windows containing anything other than ACGT score NaN.
+Running `python -m src.mes` from the project root checks this against maxentpy.
+'''
+import math
+import os
+import numpy as np
+from maxentpy import maxent
+from src.codec import encode
+
+N_NUCS = {
+    'donor': 9,
+    'acceptor': 23,
+}
+
+def kmer_hashes(codes: np.ndarray, k: int, start: int = 0, n_windows: int = None):
+    '''
+        Rolling base-4 hash (identical to MaxEntScan's hashseq) of the k-mer at offset `start` of every window.
+        Windows are consecutive positions of `codes`; codes must be < 4.
+    '''
+    if n_windows is None:
+        n_windows = len(codes) - start - k + 1
+    hashes = np.zeros(n_windows, dtype=np.int64)
+    for i in range(k):
+        hashes = (hashes << 2) | codes[start+i:start+i+n_windows]
+    return hashes
+
+def hash_kmer(kmer: str):
+    return int(kmer_hashes(encode(kmer), len(kmer))[0])
+
+def lookup_table(matrix: dict, k: int):
+    '''Converts a maxentpy matrix (keyed by k-mer or by its hash) into an array indexed by k-mer hash'''
+    table = np.full(4**k, np.nan)
+    for key, score in matrix.items():
+        table[hash_kmer(key) if isinstance(key, str) else int(key)] = score
+    return table
+
+def consensus_table(cons1: dict, cons2: dict, bgd: dict):
+    '''Scores of the two invariant consensus nucleotides, indexed by their 2-mer hash'''
+    table = np.full(16, np.nan)
+    for first in 'ACGT':
+        for second in 'ACGT':
+            table[hash_kmer(first+second)] = cons1[first] * cons2[second] / (bgd[first] * bgd[second])
+    return table
+
+def finalise(score: np.ndarray):
+    '''
+        Final step of maxent.score5/score3, `round(math.log(score, 2), 2)`, vectorised.
+        Rounding to two decimals hides last-bit differences between numpy's and python's log, except next to a rounding tie;
+        those few windows are finalised with python floats, so results stay bit-identical.
+    '''
+    scaled = np.log2(score) * 100
+    scores = np.rint(scaled) / 100
+
+    near_tie = np.abs(scaled - np.floor(scaled) - .5) < 1e-6
+    scores[near_tie] = [round(math.log(s, 2), 2) for s in score[near_tie]]
+    return scores
+
+
+class MaxEntScorer():
+    def __init__(self, matrix5: dict = None, matrix3: dict = None):
+        matrix5 = maxent.load_matrix5() if matrix5 is None else matrix5
+        matrix3 = maxent.load_matrix3() if matrix3 is None else matrix3
+
+        self.consensus5 = consensus_table(maxent.cons1_5, maxent.cons2_5, maxent.bgd_5)
+        self.consensus3 = consensus_table(maxent.cons1_3, maxent.cons2_3, maxent.bgd_3)
+        self.table5 = lookup_table(matrix5, 7)
+
+        # score3 uses nine sub-matrices over 7-, 3- and 4-mers of the 21 non-consensus nucleotides
+        self.table3 = [lookup_table(matrix3[i], k) for i, k in enumerate([7, 7, 7, 7, 7, 3, 4, 3, 4])]
+
+    @staticmethod
+    def prepare(seq, nuc_len: int):
+        '''Returns integer codes with invalid nucleotides set to 0, a mask of valid windows and the number of windows'''
+        codes = encode(seq) if isinstance(seq, str) else np.asarray(seq, dtype=np.uint8)
+        n_windows = max(len(codes) - nuc_len + 1, 0)
+
+        invalid = np.concatenate([[0], np.cumsum(codes > 3)])
+        valid = (invalid[nuc_len:nuc_len+n_windows] - invalid[:n_windows]) == 0
+
+        return np.where(codes > 3, 0, codes).astype(np.int64), valid, n_windows
+
+    def score5(self, seq):
+        '''Scores all 9-mer windows: (exon)XXX|XXXXXX(intron)'''
+        codes, valid, n = self.prepare(seq, N_NUCS['donor'])
+
+        key = kmer_hashes(codes, 2, 3, n)
+        rest = (kmer_hashes(codes, 3, 0, n) << 8) | kmer_hashes(codes, 4, 5, n)
+
+        score = self.consensus5[key] * self.table5[rest]
+        return self.finalise(score, valid)
+
+    def score3(self, seq):
+        '''Scores all 23-mer windows: (intron)XXXXXXXXXXXXXXXXXXXX|XXX(exon)'''
+        codes, valid, n = self.prepare(seq, N_NUCS['acceptor'])
+        t = self.table3
+
+        # offsets are relative to the window; the consensus nucleotides 18 and 19 are skipped
+        rest_score = t[0][kmer_hashes(codes, 7, 0, n)]
+        rest_score = rest_score * t[1][kmer_hashes(codes, 7, 7, n)]
+        rest_score = rest_score * t[2][(kmer_hashes(codes, 4, 14, n) << 6) | kmer_hashes(codes, 3, 20, n)]
+        rest_score = rest_score * t[3][kmer_hashes(codes, 7, 4, n)]
+        rest_score = rest_score * t[4][kmer_hashes(codes, 7, 11, n)]
+        rest_score = rest_score / t[5][kmer_hashes(codes, 3, 4, n)]
+        rest_score = rest_score / t[6][kmer_hashes(codes, 4, 7, n)]
+        rest_score = rest_score / t[7][kmer_hashes(codes, 3, 11, n)]
+        rest_score = rest_score / t[8][kmer_hashes(codes, 4, 14, n)]
+
+        score = self.consensus3[kmer_hashes(codes, 2, 18, n)] * rest_score
+        return self.finalise(score, valid)
+
+    @staticmethod
+    def finalise(score: np.ndarray, valid: np.ndarray):
+        scores = np.full(len(score), np.nan)
+        if valid.any():
+            scores[valid] = finalise(score[valid])
+        return scores
+
+    def score(self, seq, ss_type: str):
+        '''Scores all windows of `seq` for `ss_type` (donor/acceptor)'''
+        return self.score5(seq) if ss_type == 'donor' else self.score3(seq)
+
+
+class ScoreTracks():
+    '''
+        Memory-mapped genome-wide reference MES scores, as built by src/setup/mes_tracks.py.
+        Position p (1-based) of a track holds the score of the window starting at p, aligned to the forward strand.
+        Contigs without tracks are scored by `fallback` (an object with the same `scores` method), if given.
+    '''
+    def __init__(self, directory: str, fallback=None):
+        self.directory = directory
+        self.fallback = fallback
+        self._tracks = {}
+
+    @staticmethod
+    def file_name(chrom: str, reverse_strand: bool, ss_type: str):
+        return f'{chrom}_{"minus" if reverse_strand else "plus"}_{ss_type}.npy'
+
+    def track(self, chrom: str, reverse_strand: bool, ss_type: str):
+        key = (chrom, reverse_strand, ss_type)
+        if key not in self._tracks:
+            self._tracks[key] = np.load(os.path.join(self.directory, self.file_name(*key)), mmap_mode='r')
+        return self._tracks[key]
+
+    def has_track(self, chrom: str, reverse_strand: bool, ss_type: str):
+        return (chrom, reverse_strand, ss_type) in self._tracks or os.path.isfile(os.path.join(self.directory, self.file_name(chrom, reverse_strand, ss_type)))
+
+    def scores(self, chrom: str, reverse_strand: bool, ss_type: str, start: int, end: int):
+        '''Returns reference MES scores of all windows starting in [start, end); windows beyond the chromosome ends score NaN'''
+        if self.fallback is not None and not self.has_track(chrom, reverse_strand, ss_type):
+            return self.fallback.scores(chrom, reverse_strand, ss_type, start, end)
+
+        track = self.track(chrom, reverse_strand, ss_type)
+
+        # clamp to the windows of the track, so slices neither wrap around nor come back short
+        first, last = min(max(start, 1), end), max(min(end, len(track) + 1), start)
+        scores = np.full(end - start, np.nan)
+        if first < last:
+            # MES scores have two decimals, so rounding restores the exact values from float32 tracks
+            scores[first-start:last-start] = np.round(track[first-1:last-1].astype(float), 2)
+        return scores
+
+
+if __name__ == '__main__':
+    scorer = MaxEntScorer()
+    rng = np.random.default_rng(0)
+    seq = ''.join(rng.choice(list('ACGT'), 2000))
+
+    for ss_type, fn in [('donor', maxent.score5), ('acceptor', maxent.score3)]:
+        nuc_len = N_NUCS[ss_type]
+        expected = np.array([fn(seq[i:i+nuc_len]) for i in range(len(seq) - nuc_len + 1)])
+        assert np.array_equal(scorer.score(seq, ss_type), expected), f'{ss_type} scores differ from maxentpy'
+
+    assert np.isnan(scorer.score5('cagNTAAGT')[0])
+    assert len(scorer.score3('ACGT')) == 0
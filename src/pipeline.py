@@ -0,0 +1,249 @@
+'''
+Dependency-aware parallel runner for shell tasks.
+Every task declares the files it reads and writes; a task waits for the tasks producing its inputs,
+and independent tasks run concurrently as long as their declared CPUs and memory fit into the budget.
+Output of every task goes into its own log file; wall time and peak RSS of every task are reported at the end.
+Tasks are content-addressed: a hash of their command, inputs and sources is stamped after each successful run,
+and a task whose stamp matches and whose outputs exist is skipped as up to date.
+'''
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List, NamedTuple
+
+
+class Task(NamedTuple):
+    name: str
+    command: str # executed by bash from the project root
+    inputs: List[str]
+    outputs: List[str]
+    cpus: int = 1
+    memory_gb: float = 1.0
+    sources: List[str] = () # scripts and modules run by the command; hashed like inputs
+
+
+class Result(NamedTuple):
+    status: str # ok, up to date, not selected, skipped (a dependency did not succeed), missing input or exit <code>
+    wall_time: float = 0
+    peak_rss_gb: float = 0
+
+    @property
+    def succeeded(self):
+        return self.status in ('ok', 'up to date', 'not selected')
+
+
+def total_memory_gb():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+
+class HashCache():
+    '''
+        sha256 of files (and directories, over all files within) that are only re-hashed when their size or mtime changes,
+        so large inputs such as the genome are read once.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.hashes = json.load(f)
+
+    def file_hash(self, path: str):
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        cached = self.hashes.get(path)
+        if cached is None or cached['fingerprint'] != fingerprint:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            cached = self.hashes[path] = {'fingerprint': fingerprint, 'sha256': digest.hexdigest()}
+        return cached['sha256']
+
+    def hash(self, path: str):
+        '''Hash of a file or directory; missing paths have no hash'''
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(f'{os.path.relpath(file_path, path)} {self.file_hash(file_path)}'.encode())
+            return digest.hexdigest()
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        return None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.hashes, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def dependencies(tasks: List[Task]):
+    '''Returns {task name: names of the tasks producing its inputs}'''
+    producers = {output: task.name for task in tasks for output in task.outputs}
+    return {task.name: {producers[path] for path in task.inputs if path in producers} - {task.name} for task in tasks}
+
+
+class Runner():
+    def __init__(self, cpus: int = None, memory_gb: float = None, log_dir: str = 'logs', stamp_dir: str = os.path.join('cache', 'pipeline'), force: bool = False):
+        self.cpus = cpus or os.cpu_count()
+        self.memory_gb = memory_gb or total_memory_gb()
+        self.log_dir = log_dir
+        self.stamp_dir = stamp_dir
+        self.force = force
+        self.hashes = HashCache(os.path.join(stamp_dir, 'hashes.json'))
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace):
+        return cls(args.cpus, args.memory, args.logs, force=args.force)
+
+    def log_path(self, task: Task):
+        return os.path.join(self.log_dir, f'{task.name}.log')
+
+    def stamp_path(self, task: Task):
+        return os.path.join(self.stamp_dir, f'{task.name}.json')
+
+    def key(self, task: Task):
+        '''Hash over the command (including its parameters), the inputs and the sources of a task'''
+        return hashlib.sha256(json.dumps({
+            'command': task.command,
+            'inputs': {path: self.hashes.hash(path) for path in task.inputs},
+            'sources': {path: self.hashes.hash(path) for path in task.sources},
+        }, sort_keys=True).encode()).hexdigest()
+
+    def up_to_date(self, task: Task, key: str):
+        '''If a task ran successfully on the same command, inputs and sources, and its outputs still exist'''
+        if self.force or not os.path.isfile(self.stamp_path(task)):
+            return False
+        with open(self.stamp_path(task)) as f:
+            stamped = json.load(f)['key']
+        return stamped == key and all(os.path.exists(path) for path in task.outputs)
+
+    def stamp(self, task: Task, key: str):
+        os.makedirs(self.stamp_dir, exist_ok=True)
+        with open(self.stamp_path(task) + '.tmp', 'w') as f:
+            json.dump({'key': key}, f)
+        os.replace(self.stamp_path(task) + '.tmp', self.stamp_path(task))
+
+    def fits(self, task: Task, running: dict):
+        '''If a task fits into the budget next to the running ones; a task exceeding the whole budget may run on its own'''
+        if not running:
+            return True
+        running_tasks = [entry[0] for entry in running.values()]
+        cpus = sum(t.cpus for t in running_tasks) + task.cpus
+        memory = sum(t.memory_gb for t in running_tasks) + task.memory_gb
+        return cpus <= self.cpus and memory <= self.memory_gb
+
+    def start(self, task: Task):
+        os.makedirs(self.log_dir, exist_ok=True)
+        log = open(self.log_path(task), 'w')
+        process = subprocess.Popen(['bash', '-c', task.command], stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        print(f'[{task.name}] started, logging to {self.log_path(task)}', file=sys.stderr)
+        return process, log
+
+    def run(self, tasks: List[Task], only: List[str] = None):
+        '''
+        Runs all tasks, or only those named in `only` (the others count as succeeded); up-to-date tasks are skipped unless forced
+        and tasks depending on a failed task are skipped. Returns {task name: Result}.
+        '''
+        unknown = set(only or []) - {task.name for task in tasks}
+        if unknown:
+            raise ValueError(f'Unknown tasks: {", ".join(sorted(unknown))}')
+
+        depends_on = dependencies(tasks)
+        pending = list(tasks)
+        running = {} # pid -> (task, key, process, log, start time)
+        results = {}
+
+        while pending or running:
+            progressed = False
+
+            # tasks are started in declaration order as soon as their dependencies succeeded and they fit into the budget
+            for task in list(pending):
+                states = [results[dependency].succeeded if dependency in results else None for dependency in depends_on[task.name]]
+                if only and task.name not in only:
+                    pending.remove(task)
+                    progressed = True
+                    results[task.name] = Result('not selected')
+                elif False in states:
+                    pending.remove(task)
+                    progressed = True
+                    results[task.name] = Result('skipped')
+                    print(f'[{task.name}] skipped, a dependency did not succeed', file=sys.stderr)
+                elif None not in states and self.fits(task, running):
+                    pending.remove(task)
+                    progressed = True
+
+                    missing = [path for path in task.inputs if not os.path.exists(path)]
+                    if missing:
+                        results[task.name] = Result('missing input')
+                        print(f'[{task.name}] skipped, inputs do not exist: {", ".join(missing)}', file=sys.stderr)
+                        continue
+
+                    # inputs are hashed once all producers finished
+                    key = self.key(task)
+                    if self.up_to_date(task, key):
+                        results[task.name] = Result('up to date')
+                        print(f'[{task.name}] up to date', file=sys.stderr)
+                        continue
+
+                    process, log = self.start(task)
+                    running[process.pid] = (task, key, process, log, time.perf_counter())
+
+            if not running:
+                if pending and progressed:
+                    # tasks that were up to date or not selected may have unblocked others
+                    continue
+                if pending:
+                    raise RuntimeError(f'Tasks depend on each other in a cycle: {", ".join(task.name for task in pending)}')
+                break
+
+            # wait4 reports the peak RSS of the finished task, including its (waited for) child processes
+            pid, status, usage = os.wait4(-1, 0)
+            if pid not in running:
+                continue
+            task, key, process, log, start = running.pop(pid)
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            log.close()
+
+            if process.returncode == 0:
+                self.stamp(task, key)
+            results[task.name] = Result('ok' if process.returncode == 0 else f'exit {process.returncode}', time.perf_counter() - start, usage.ru_maxrss / 1024**2)
+            outcome = 'finished' if process.returncode == 0 else f'failed with exit code {process.returncode}'
+            print(f'[{task.name}] {outcome} after {results[task.name].wall_time:.0f}s', file=sys.stderr)
+
+        self.hashes.save()
+        return {task.name: results[task.name] for task in tasks}
+
+    @staticmethod
+    def report(results: dict):
+        '''Table of status, wall time and peak RSS per task'''
+        lines = [f'{"Task":<30} {"Status":<13} {"Wall time":>10} {"Peak RSS":>10}']
+        for name, result in results.items():
+            lines.append(f'{name:<30} {result.status:<13} {result.wall_time:>9.0f}s {result.peak_rss_gb:>8.2f}GB')
+        return '\n'.join(lines)
+
+
+def argument_parser(description: str, log_dir: str):
+    '''Command line options shared by all pipelines, see `Runner.from_args` and `main`'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-c', '--cpus', type=int, default=None, help='CPU budget; defaults to all cores')
+    parser.add_argument('-m', '--memory', type=float, default=None, help='memory budget in GB; defaults to all memory')
+    parser.add_argument('--logs', default=log_dir, help='directory of the per-task logs')
+    parser.add_argument('-f', '--force', action='store_true', help='run tasks even if they are up to date')
+    parser.add_argument('--only', nargs='+', metavar='TASK', help='only run these tasks')
+    return parser
+
+def main(runner: Runner, tasks: List[Task], only: List[str] = None):
+    '''Runs tasks, prints the report and exits with an error if any task did not succeed'''
+    results = runner.run(tasks, only)
+    print(Runner.report(results))
+
+    if not all(result.succeeded for result in results.values()):
+        sys.exit(1)
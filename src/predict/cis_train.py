@@ -1,10 +1,14 @@
 import os
+import sys
 from cispliceai.model import CISpliceAI
-from cispliceai.annotation import Annotator
 
-# load CIS but substitute their models which those from src directory which were trained holding out chromosomes 1,3,5,7,9
+sys.path.append(os.path.abspath('.'))
+from src.cis_annotation import RegionAnnotator
+
+# load CIS but substitute their models which those from src directory which were trained holding out chromosomes 1,3,5,7,9
 cis_train = CISpliceAI(os.path.join('src', 'CI-SpliceAI-TRAIN.pb'))
-annotator = Annotator(model=cis_train)
+# predicts the reference of nearby variants in the same gene once, see src/cis_annotation.py
+annotator = RegionAnnotator(model=cis_train)
 
 annotator.annotate_vcf(
     reference_path=os.path.join('third-party', 'hg', 'hg38.fa'),
@@ -13,4 +17,4 @@ annotator.annotate_vcf(
     annotation_table='grch38',
     max_dist_from_var=5000,
     most_significant_only=False
-)
\ No newline at end of file
+)
@@ -1,4 +1,7 @@
-from typing import Tuple
+from typing import List, NamedTuple, Tuple
+import argparse
+import collections
+import multiprocessing
 import pysam
 import os
 import numpy as np
@@ -6,7 +9,8 @@ import sys
 from maxentpy import maxent
 
 sys.path.append(os.path.abspath('.'))
-from src import helpers
+from src import codec, genome, helpers
+from src.mes import MaxEntScorer, ScoreTracks
 
 
 genome_path = os.path.join('third-party', 'hg', 'hg38.fa')
@@ -21,32 +25,107 @@ n_nucs_before_jn = {
     'acceptor': 20,
 }
 
-# load MES
-matrices = {
-    'donor': maxent.load_matrix5(),
-    'acceptor': maxent.load_matrix3(),
-}
-scorers = {
-    'donor': maxent.score5,
-    'acceptor': maxent.score3,
-}
+# load MES; all windows of a sequence are scored in one batch
+scorer = MaxEntScorer(maxent.load_matrix5(), maxent.load_matrix3())
+
+
+class Variant(NamedTuple):
+    '''Picklable stand-in for the fields of pysam.VariantRecord used here'''
+    chrom: str
+    pos: int
+    ref: str
+    alts: Tuple[str]
+
+
+class ReferenceCache():
+    '''
+        Per-run LRU cache of reference sequence and reference MES scores, in blocks of `block_size` positions.
+        Nearby variants share blocks, so each cluster of variants is read from the FASTA and scored only once.
+    '''
+    def __init__(self, block_size: int = 4096, max_blocks: int = 1024):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._sequences = collections.OrderedDict() # (chrom, block) -> sequence
+        self._scores = collections.OrderedDict() # (chrom, reverse strand, site type, block) -> scores of windows starting in block
+
+    def _get(self, cache: collections.OrderedDict, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _put(self, cache: collections.OrderedDict, key, value):
+        cache[key] = value
+        if len(cache) > self.max_blocks:
+            cache.popitem(last=False)
+
+    def _blocks(self, start: int, end: int):
+        # 1-based positions; block b covers [b*block_size+1, (b+1)*block_size+1)
+        return range((start-1) // self.block_size, (end-2) // self.block_size + 1)
+
+    def sequence(self, chrom: str, start: int, end: int):
+        '''Returns the reference sequence [start, end) (1-based)'''
+        blocks = self._blocks(start, end)
+        block_seqs = {block: self._get(self._sequences, (chrom, block)) for block in blocks}
+        missing = [block for block, seq in block_seqs.items() if seq is None]
+
+        if missing:
+            # read all missing blocks with a single FASTA access
+            fetch_start = missing[0] * self.block_size + 1
+            seq = helpers.extract_sequence(genome_path, chrom, fetch_start, (missing[-1] + 1) * self.block_size + 1)
+            for block in missing:
+                offset = block * self.block_size + 1 - fetch_start
+                block_seqs[block] = seq[offset:offset+self.block_size]
+                self._put(self._sequences, (chrom, block), block_seqs[block])
 
+        seq = ''.join(block_seqs[block] for block in blocks)
+        offset = start - (blocks[0] * self.block_size + 1)
+        return seq[offset:offset+end-start]
 
-def get_seq(line: pysam.VariantRecord, context: Tuple[int], rc: bool, apply_var: bool):
+    def scores(self, chrom: str, reverse_strand: bool, ss_type: str, start: int, end: int):
+        '''Returns reference MES scores of all windows starting in [start, end), aligned to the forward strand'''
+        nuc_len = n_nucs[ss_type]
+        blocks = self._blocks(start, end)
+        block_scores = []
+
+        for block in blocks:
+            key = (chrom, reverse_strand, ss_type, block)
+            scores = self._get(self._scores, key)
+
+            if scores is None:
+                block_start = block * self.block_size + 1
+                seq = self.sequence(chrom, block_start, block_start + self.block_size + nuc_len - 1)
+                if reverse_strand:
+                    scores = scorer.score(codec.reverse_complement_codes(codec.encode(seq)), ss_type)[::-1]
+                else:
+                    scores = scorer.score(seq, ss_type)
+                self._put(self._scores, key, scores)
+
+            block_scores.append(scores)
+
+        offset = start - (blocks[0] * self.block_size + 1)
+        return np.concatenate(block_scores)[offset:offset+end-start]
+
+reference = ReferenceCache()
+# source of reference scores; precomputed ScoreTracks if available, otherwise the reference cache
+reference_scores = reference
+
+
+def get_seq(line: Variant, context: Tuple[int], rc: bool, apply_var: bool):
     assert len(line.alts) == 1, 'This code can only handle one alt per variant'
     alt = line.alts[0]
-    seq = helpers.extract_sequence(genome_path, line.chrom, line.pos-context[0], line.pos+context[1])
+    seq = reference.sequence(line.chrom, line.pos-context[0], line.pos+context[1])
     assert seq[context[0]:context[0]+len(line.ref)] == line.ref.upper(), 'mismatching REF annotation'
     
     if apply_var:
         seq = seq[:context[0]]+alt+seq[context[0]+len(line.ref):]
     
     if rc:
-        return helpers.reverse_complement(seq)
+        return codec.reverse_complement(seq)
     return seq
 
 
-def pred_MES(line: pysam.VariantRecord):
+def pred_MES(line: Variant):
     # runs MES on both strands around the variant and annotates the delta score
     annotations = []
 
@@ -56,19 +135,16 @@ def pred_MES(line: pysam.VariantRecord):
         DS_AL = DS_AG = DP_AL = DP_DG = DS_DG = DP_DG = 0
 
         for ss_type_num, (ss_type, nuc_len) in enumerate(n_nucs.items()): # site_type is acceptor/donor, each have their own length
-            matrix = matrices[ss_type]
-            scorer = scorers[ss_type]
             context = (pred_lens[ss_type_num]-1, pred_lens[ss_type_num])
 
-            # predict ref and var
-            preds = []
-            for apply_var in (False, True):
-                seq = get_seq(line, context, reverse_strand, apply_var)
-
-                preds.append([scorer(seq[i:i+nuc_len], matrix=matrix) for i in range(len(seq) - nuc_len + 1)])
+            # predict var; reference scores are shared between nearby variants
+            preds_var = scorer.score(get_seq(line, context, reverse_strand, True), ss_type)
+            n_preds = context[0] + context[1] - nuc_len + 1
+            preds_ref = reference_scores.scores(line.chrom, reverse_strand, ss_type, line.pos-context[0], line.pos-context[0]+n_preds)
 
-            preds_ref, preds_var = preds
-            preds_ref, preds_var = np.array(preds_ref), np.array(preds_var)
+            if reverse_strand:
+                # predictions are reversed back onto the forward strand below
+                preds_ref = preds_ref[::-1]
 
             diff = abs(len(preds_ref) - len(preds_var))
             if diff:
@@ -131,18 +207,119 @@ def pred_MES(line: pysam.VariantRecord):
         annotations.append(f'{line.alts[0]}|{"-" if reverse_strand else "+"}|{DS_AG:.2f}|{DS_AL:.2f}|{DS_DG:.2f}|{DS_DL:.2f}|{DP_AG}|{DP_AL}|{DP_DG}|{DP_DL}')
     return annotations
 
-# load variants
-with pysam.VariantFile(os.path.join('variants', 'variants.vcf'), 'r') as file_in:
-    header = file_in.header
-    vcf = [v for v in file_in]
 
-header.add_line(
-    '##INFO=<ID=MES_SLIDING,Number=.,Type=String,Description="MES_SLIDING annotations. ALLELE|STRAND|DS_AG|DS_AL|DS_DG|DS_DL|DP_AG|DP_AL|DP_DG|DP_DL (DS=Delta Score, DP=Delta Position, AG/AL=Acceptor Gain/Acceptor Loss, DG/DL=Donor Gain/Donor Loss.'
-)
+def init_reference(cache_blocks: int, tracks_dir: str):
+    global reference, reference_scores
+    reference = ReferenceCache(max_blocks=cache_blocks)
+    # contigs without precomputed tracks are scored live
+    reference_scores = reference if tracks_dir is None else ScoreTracks(tracks_dir, fallback=reference)
+
+
+# worker processes keep their own FASTA handle, MES matrices, reference cache and track mappings
+def init_worker(cache_blocks: int, tracks_dir: str):
+    global scorer
+    helpers.fasta = genome.PackedFasta()
+    scorer = MaxEntScorer(maxent.load_matrix5(), maxent.load_matrix3())
+    init_reference(cache_blocks, tracks_dir)
+
+
+def pred_chunk(chunk: List[Variant]):
+    return [pred_MES(variant) for variant in chunk]
+
+
+def batches(records, shard_by: str, chunk_size: int):
+    '''Groups a stream of records into lists of at most `chunk_size`; with shard_by='chrom' batches never span two chromosomes.'''
+    batch = []
+    for record in records:
+        if batch and (len(batch) == chunk_size or (shard_by == 'chrom' and record.chrom != batch[-1].chrom)):
+            yield batch
+            batch = []
+        batch.append(record)
+
+    if batch:
+        yield batch
+
+
+def annotate(records, workers: int, chunk_size: int, shard_by: str, cache_blocks: int, tracks_dir: str = None):
+    '''
+        Runs pred_MES on a stream of VCF records and emits them annotated, in input order.
+        At most 2 batches per worker are in flight, so memory stays constant regardless of input size.
+    '''
+    def to_variants(batch):
+        # VariantRecords cannot be sent to worker processes
+        return [Variant(line.chrom, line.pos, line.ref, line.alts) for line in batch]
+
+    def annotated(batch, annotations):
+        for line, annotation in zip(batch, annotations):
+            line.info['MES_SLIDING'] = annotation
+            yield line
+
+    if workers == 1:
+        init_reference(cache_blocks, tracks_dir)
+        for batch in batches(records, shard_by, chunk_size):
+            yield from annotated(batch, pred_chunk(to_variants(batch)))
+        return
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(cache_blocks, tracks_dir)) as pool:
+        in_flight = collections.deque()
+        for batch in batches(records, shard_by, chunk_size):
+            in_flight.append((batch, pool.apply_async(pred_chunk, (to_variants(batch),))))
+
+            if len(in_flight) >= 2 * workers:
+                batch, result = in_flight.popleft()
+                yield from annotated(batch, result.get())
+
+        while in_flight:
+            batch, result = in_flight.popleft()
+            yield from annotated(batch, result.get())
+
+
+def tabix_sortable(path: str):
+    '''If the records of a VCF are grouped by chromosome and sorted by position within each, as tabix requires'''
+    seen = set()
+    chrom, pos = None, 0
+    with pysam.VariantFile(path) as f:
+        for record in f:
+            if record.chrom != chrom:
+                if record.chrom in seen:
+                    return False
+                seen.add(record.chrom)
+            elif record.pos < pos:
+                return False
+            chrom, pos = record.chrom, record.pos
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Annotates variants with MaxEntScan delta scores in a sliding window on both strands.')
+    parser.add_argument('-i', '--input', default=os.path.join('variants', 'variants.vcf'))
+    parser.add_argument('-o', '--output', default=os.path.join('predictions', 'mes_sliding.vcf'), help='output VCF; a .gz suffix writes bgzip-compressed output with a tabix index')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes; 0 uses all cores')
+    parser.add_argument('-c', '--chunk-size', type=int, default=1000, help='maximum number of variants per task')
+    parser.add_argument('-s', '--shard-by', choices=['chunk', 'chrom'], default='chunk', help='split tasks by fixed-size chunks or by chromosome')
+    parser.add_argument('--cache-blocks', type=int, default=1024, help='number of 4096 nt reference blocks kept in the LRU cache per worker')
+    parser.add_argument('-t', '--tracks', help='directory of precomputed reference score tracks (see src/setup/mes_tracks.py); only alt alleles are scored live')
+    args = parser.parse_args()
+
+    compress = args.output.endswith('.gz')
+
+    # the index is created after scoring, so an input tabix cannot index is rejected before any work is done
+    if compress and not tabix_sortable(args.input):
+        parser.error(f'{args.input} is not sorted by chromosome and position, which the index of a .gz output requires; sort it (e.g. bcftools sort) or write uncompressed output')
+
+    # records are annotated and written batch by batch, so partial output reaches disk early
+    with pysam.VariantFile(args.input, 'r') as file_in:
+        header = file_in.header
+        header.add_line(
+            '##INFO=<ID=MES_SLIDING,Number=.,Type=String,Description="MES_SLIDING annotations. ALLELE|STRAND|DS_AG|DS_AL|DS_DG|DS_DL|DP_AG|DP_AL|DP_DG|DP_DL (DS=Delta Score, DP=Delta Position, AG/AL=Acceptor Gain/Acceptor Loss, DG/DL=Donor Gain/Donor Loss.'
+        )
 
-for line in vcf:
-    line.info['MES_SLIDING'] = pred_MES(line)
+        with pysam.VariantFile(args.output, 'wz' if compress else 'w', header=header) as file_out:
+            for line in annotate(file_in, args.workers or os.cpu_count(), args.chunk_size, args.shard_by, args.cache_blocks, args.tracks):
+                file_out.write(line)
 
-with pysam.VariantFile(os.path.join('predictions', 'mes_sliding.vcf'), 'w', header=header) as file_out:
-    for line in vcf:
-        file_out.write(line)
+    if compress:
+        try:
+            pysam.tabix_index(args.output, preset='vcf', force=True)
+        except OSError as e:
+            sys.exit(f'Could not index {args.output} ({e}); the bgzipped output is complete and can be indexed once sorted, e.g. with bcftools sort')
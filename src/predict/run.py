@@ -0,0 +1,73 @@
+# this script is executed by predict.sh. cwd is expected to be project root
+# it converts the variants and runs all predictors concurrently within a CPU and memory budget, skipping those that are up to date, see src/pipeline.py
+
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+from src import pipeline
+from src.pipeline import Runner, Task
+
+HG = os.path.abspath(os.path.join('third-party', 'hg', 'hg38.fa'))
+VARIANTS = os.path.join('variants', 'variants.vcf')
+VARIANTS_MMS = os.path.join('variants', 'variants_mmsplice.vcf')
+MES_TRACKS = os.path.join('third-party', 'mes_tracks')
+
+# conda is a shell function, so tasks running in another environment source it first
+CONDA = 'source src/helpers.sh && '
+
+
+def mmsplice(model: str, output: str):
+    # kipoi reads dataloader args as YAML
+    args = f'{{gtf: {os.path.abspath("third-party/mmsplice/protein_coding_no_dups.gtf")}, fasta_file: {HG}, vcf_file: {os.path.abspath(VARIANTS_MMS)}}}'
+    return CONDA + f'conda activate kipoi-MMSplice__splicingEfficiency && cd ~/.kipoi/models/MMSplice/{model} && ' +\
+        f"kipoi predict MMSplice/{model} -m --dataloader_args='{args}' -o {os.path.abspath(output)}"
+
+# modules run by the python predictors and the conversion of the variants
+CONVERT_SOURCES = ['src/csv_to_vcf/main.sh', 'src/csv_to_vcf/convert.py', 'src/helpers.py', 'src/genome.py', 'src/codec.py']
+CIS_TRAIN_SOURCES = ['src/predict/cis_train.py', 'src/cis_annotation.py', 'src/codec.py']
+MES_SLIDING_SOURCES = ['src/predict/mes_sliding.py', 'src/mes.py', 'src/codec.py', 'src/genome.py', 'src/helpers.py']
+
+
+def mes_sliding(workers: int):
+    tracks = f' --tracks {MES_TRACKS}' if os.path.isdir(MES_TRACKS) else ''
+    return f'python src/predict/mes_sliding.py --workers {workers}{tracks}'
+
+
+tasks = [
+    # variants.csv is checked against the genome and normalised into the VCFs all predictors read
+    Task('convert', 'bash src/csv_to_vcf/main.sh',
+        [os.path.join('variants', 'variants.csv'), HG], [VARIANTS, VARIANTS_MMS], cpus=1, memory_gb=2, sources=CONVERT_SOURCES),
+    Task('spliceai', f'spliceai -I {VARIANTS} -O predictions/spliceai.vcf -R {HG} -A grch38 -D 4999',
+        [VARIANTS, HG], ['predictions/spliceai.vcf'], cpus=4, memory_gb=8),
+    Task('cis', f'cis-vcf --all -i {VARIANTS} -o predictions/cis.vcf -a grch38 -d 5000 {HG}',
+        [VARIANTS, HG], ['predictions/cis.vcf'], cpus=4, memory_gb=8),
+    # CI-SpliceAI trained on TRAIN chroms only
+    Task('cis_train', 'python src/predict/cis_train.py',
+        [VARIANTS, HG, 'src/CI-SpliceAI-TRAIN.pb'], ['predictions/cis_train.vcf'], cpus=4, memory_gb=8, sources=CIS_TRAIN_SOURCES),
+    Task('squirls', f'java -jar third-party/squirls/squirls-cli-1.0.0/squirls-cli-1.0.0.jar annotate-vcf src/predict/squirls-config.yml third-party/squirls/jannovar/hg38_refseq.ser {VARIANTS} predictions/squirls -f vcf',
+        [VARIANTS], ['predictions/squirls.vcf'], cpus=2, memory_gb=8),
+    Task('mmsplice_splicing_efficiency', mmsplice('splicingEfficiency', 'predictions/mmsplice_splicing_efficiency.tsv'),
+        [VARIANTS_MMS, HG], ['predictions/mmsplice_splicing_efficiency.tsv'], cpus=2, memory_gb=8),
+    Task('mmsplice_pathogenicity', mmsplice('pathogenicity', 'predictions/mmsplice_pathogenicity.tsv'),
+        [VARIANTS_MMS, HG], ['predictions/mmsplice_pathogenicity.tsv'], cpus=2, memory_gb=8),
+    # MES via VEP; runs without a TTY as there is no terminal to attach
+    Task('mes_vep', f'cp {VARIANTS} ~/vep_data/variants_splicing_comparison.vcf && ' +\
+        'docker run -v ~/vep_data:/opt/vep/.vep ensemblorg/ensembl-vep vep --distance 5000 --hgvs --vcf --force_overwrite --plugin MaxEntScan,/opt/vep/.vep/Plugins/maxentscan --species homo_sapiens --transcript_version --input_file /opt/vep/.vep/variants_splicing_comparison.vcf  --output_file /opt/vep/.vep/output_splicing_comparison.vcf --database && ' +\
+        'cp ~/vep_data/output_splicing_comparison.vcf predictions/mes_vep.vcf',
+        [VARIANTS], ['predictions/mes_vep.vcf'], cpus=2, memory_gb=4),
+]
+
+
+if __name__ == '__main__':
+    parser = pipeline.argument_parser('Runs all predictors on the variants, independent ones concurrently.', os.path.join('logs', 'predict'))
+    args = parser.parse_args()
+
+    runner = Runner.from_args(args)
+
+    # MES (Sliding) uses its own process pool; it gets half the budget so the other predictors can run next to it
+    mes_workers = max(1, runner.cpus // 2)
+    mes_inputs = [VARIANTS, HG] + ([MES_TRACKS] if os.path.isdir(MES_TRACKS) else [])
+    tasks.append(Task('mes_sliding', mes_sliding(mes_workers), mes_inputs, ['predictions/mes_sliding.vcf'], cpus=mes_workers, memory_gb=4, sources=MES_SLIDING_SOURCES))
+
+    pipeline.main(runner, tasks, args.only)
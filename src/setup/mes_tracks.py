@@ -0,0 +1,76 @@
+# this script is executed by setup.sh. cwd is expected to be project root
+# it precomputes reference MES scores for every position of the genome, used by src/predict/mes_sliding.py --tracks
+
+import argparse
+import multiprocessing
+import os
+import sys
+import numpy as np
+import pyfaidx
+
+sys.path.append(os.path.abspath('.'))
+from src import codec, mes
+from src.pipeline import total_memory_gb
+
+genome_path = os.path.join('third-party', 'hg', 'hg38.fa')
+tracks_dir = os.path.join('third-party', 'mes_tracks')
+
+# peak memory of a worker on the largest hg38 chromosome: its sequence and codes (~0.5 GB) plus the k-mer hashes of one chunk
+GB_PER_WORKER = 2
+
+
+def default_workers():
+    '''As many workers as cores, but no more than fit into memory'''
+    return max(1, min(os.cpu_count(), int(total_memory_gb() // GB_PER_WORKER)))
+
+
+def build_chromosome(chrom: str, dtype: str, chunk_size: int):
+    '''Writes donor and acceptor score tracks of both strands for one chromosome'''
+    scorer = mes.MaxEntScorer()
+    codes = None
+
+    for ss_type, nuc_len in mes.N_NUCS.items():
+        for reverse_strand in (False, True):
+            path = os.path.join(tracks_dir, mes.ScoreTracks.file_name(chrom, reverse_strand, ss_type))
+            if os.path.isfile(path):
+                continue
+
+            if codes is None:
+                codes = codec.encode(pyfaidx.Fasta(genome_path)[chrom][:].seq)
+
+            n_windows = max(len(codes) - nuc_len + 1, 0)
+
+            # write into a temporary file first so interrupted builds are redone
+            tmp_path = path + '.tmp.npy'
+            track = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(n_windows,))
+
+            for start in range(0, n_windows, chunk_size):
+                end = min(start + chunk_size, n_windows)
+                window_codes = codes[start:end+nuc_len-1]
+
+                if reverse_strand:
+                    # score the reverse complement and align scores back to the forward strand
+                    track[start:end] = scorer.score(codec.reverse_complement_codes(window_codes), ss_type)[::-1]
+                else:
+                    track[start:end] = scorer.score(window_codes, ss_type)
+
+            track.flush()
+            del track
+            os.replace(tmp_path, path)
+
+    return chrom
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes memory-mapped donor and acceptor MES score tracks for both strands of every chromosome.')
+    parser.add_argument('--chroms', nargs='+', default=['chr%s' % c for c in list(range(1, 23)) + ['X', 'Y']])
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32', help='float16 halves the size but no longer reproduces scores exactly')
+    parser.add_argument('-w', '--workers', type=int, default=0, help=f'number of chromosomes built in parallel, each needing about {GB_PER_WORKER} GB; 0 uses all cores that fit into memory')
+    parser.add_argument('-c', '--chunk-size', type=int, default=1 << 22, help='number of windows scored per batch')
+    args = parser.parse_args()
+
+    os.makedirs(tracks_dir, exist_ok=True)
+
+    with multiprocessing.Pool(args.workers or default_workers()) as pool:
+        for chrom in pool.starmap(build_chromosome, [(chrom, args.dtype, args.chunk_size) for chrom in args.chroms]):
+            print(f'Built MES tracks for {chrom}')
@@ -0,0 +1,21 @@
+# this script is executed by setup.sh. cwd is expected to be project root
+# it converts the reference genome into the 2-bit packed store that src/helpers.py reads sequences from
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+from src import genome
+
+genome_path = os.path.join('third-party', 'hg', 'hg38.fa')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a FASTA file into a memory-mapped 2-bit packed genome store.')
+    parser.add_argument('-g', '--genome', default=genome_path)
+    parser.add_argument('--chroms', nargs='+', default=None, help='sequences to convert; all by default')
+    args = parser.parse_args()
+
+    for chrom in genome.convert(args.genome, args.chroms):
+        print(f'Packed {chrom}')